@@ -5,11 +5,15 @@ import sys
 
 from pit.commands.add import AddCommand
 from pit.commands.branch import BranchCommand
+from pit.commands.cat_file import CatFileCommand
 from pit.commands.checkout import CheckoutCommand
 from pit.commands.commit import CommitCommand
 from pit.commands.diff import DiffCommand
+from pit.commands.fsmonitor import FSMonitorCommand
 from pit.commands.init import InitCommand
 from pit.commands.log import LogCommand
+from pit.commands.repack import RepackCommand
+from pit.commands.sparse_checkout import SparseCheckoutCommand
 from pit.commands.status import StatusCommand
 from pit.pager import pager
 
@@ -34,6 +38,7 @@ def generate_parser():
     add_cmd = subparsers.add_parser("add", help="add help")
     add_cmd.set_defaults(cmd="add")
     add_cmd.add_argument('files', nargs='+')
+    add_cmd.add_argument('-j', '--jobs', type=int, default=None)
 
     status_cmd = subparsers.add_parser("status", help="status help")
     status_cmd.set_defaults(cmd="status")
@@ -53,11 +58,34 @@ def generate_parser():
     checkout_cmd = subparsers.add_parser("checkout", help="checkout help")
     checkout_cmd.set_defaults(cmd="checkout")
     checkout_cmd.add_argument('revision', nargs='?', default=None)
+    checkout_cmd.add_argument('--into')
 
     log_cmd = subparsers.add_parser("log", help="log help")
     log_cmd.add_argument('--oneline', action='store_true')
     log_cmd.set_defaults(cmd="log")
 
+    cat_file_cmd = subparsers.add_parser("cat-file", help="cat-file help")
+    cat_file_cmd.set_defaults(cmd="cat-file")
+    cat_file_mode = cat_file_cmd.add_mutually_exclusive_group(required=True)
+    cat_file_mode.add_argument('-t', dest='mode', action='store_const', const='type')
+    cat_file_mode.add_argument('-s', dest='mode', action='store_const', const='size')
+    cat_file_mode.add_argument('-p', dest='mode', action='store_const', const='pretty')
+    cat_file_cmd.add_argument('object')
+
+    repack_cmd = subparsers.add_parser("repack", aliases=["gc"], help="repack help")
+    repack_cmd.set_defaults(cmd="repack")
+    repack_cmd.add_argument('--window', type=int, default=None)
+    repack_cmd.add_argument('--depth', type=int, default=None)
+
+    fsmonitor_cmd = subparsers.add_parser("fsmonitor", help="fsmonitor help")
+    fsmonitor_cmd.set_defaults(cmd="fsmonitor")
+    fsmonitor_cmd.add_argument('action', choices=['start', 'stop', 'status', 'run'])
+
+    sparse_checkout_cmd = subparsers.add_parser("sparse-checkout", help="sparse-checkout help")
+    sparse_checkout_cmd.set_defaults(cmd="sparse-checkout")
+    sparse_checkout_cmd.add_argument('action', choices=['set', 'add', 'list', 'disable'])
+    sparse_checkout_cmd.add_argument('dirs', nargs='*')
+
     return parser
 
 
@@ -73,7 +101,7 @@ def entrypoint():
                           author_email=os.getenv("GIT_AUTHOR_EMAIL"),
                           commit_msg=args.message).run()
         case "add":
-            AddCommand(root_dir, paths=args.files).run()
+            AddCommand(root_dir, paths=args.files, jobs=args.jobs).run()
         case "status":
             StatusCommand(root_dir, porcelain=args.porcelain).run()
         case "diff":
@@ -82,10 +110,18 @@ def entrypoint():
         case "branch":
             BranchCommand(root_dir, name=args.name, revision=args.revision, delete=args.delete, verbose=args.verbose).run()
         case "checkout":
-            CheckoutCommand(root_dir, revision=args.revision).run()
+            CheckoutCommand(root_dir, revision=args.revision, into=args.into).run()
         case "log":
             with pager():
                 LogCommand(root_dir, oneline=args.oneline).run()
+        case "cat-file":
+            CatFileCommand(root_dir, object=args.object, mode=args.mode).run()
+        case "repack":
+            RepackCommand(root_dir, window=args.window, depth=args.depth).run()
+        case "fsmonitor":
+            FSMonitorCommand(root_dir, action=args.action).run()
+        case "sparse-checkout":
+            SparseCheckoutCommand(root_dir, action=args.action, dirs=args.dirs).run()
         case _:
             print('Unsupported command: ', args.cmd)
 
@@ -0,0 +1,82 @@
+from collections import OrderedDict
+from typing import Any, Hashable
+
+
+class LRUCache:
+    """Least-recently-used cache whose capacity is a byte budget rather than an entry count"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[Hashable, (Any, int)] = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key: Hashable, value: Any, size: int):
+        if key in self._entries:
+            self.bytes -= self._entries.pop(key)[1]
+        # an entry larger than the whole budget would only flush everything else out
+        if size > self.max_bytes:
+            return
+        while self._entries and self.bytes + size > self.max_bytes:
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self.bytes -= evicted_size
+        self._entries[key] = (value, size)
+        self.bytes += size
+
+    def clear(self):
+        self._entries.clear()
+        self.bytes = 0
+
+
+class ObjectCache:
+    """
+    Decoded objects by oid, with a separate byte budget per object type so that a few
+    large blobs cannot push out the commits and trees every history or tree walk needs.
+    The size of an object is the length of its serialized form.
+    """
+
+    def __init__(self, limits: dict[str, int]):
+        self.caches = {type_: LRUCache(limit) for type_, limit in limits.items()}
+
+    def get(self, oid: str) -> Any:
+        for cache in self.caches.values():
+            if oid in cache:
+                return cache.get(oid)
+        return None
+
+    def put(self, oid: str, obj: Any, size: int):
+        cache = self.caches.get(obj.type)
+        if cache is None:
+            return
+        # a miss is only attributable to a type once the object has been decoded
+        cache.misses += 1
+        cache.put(oid, obj, size)
+
+    @property
+    def stats(self) -> dict[str, dict[str, int]]:
+        return {
+            type_: {
+                "hits": cache.hits,
+                "misses": cache.misses,
+                "entries": len(cache),
+                "bytes": cache.bytes,
+                "limit": cache.max_bytes,
+            }
+            for type_, cache in self.caches.items()
+        }
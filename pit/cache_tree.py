@@ -0,0 +1,77 @@
+from dataclasses import dataclass, field
+
+
+@dataclass
+class CacheTree:
+    """
+    The TREE index extension: the tree oid of every directory as of the last commit,
+    with the number of index entries it covers. Adding or removing a path invalidates
+    (entry_count = -1) every tree along that path, so a valid node means that the
+    directory can be reused as is when writing the next commit.
+
+    On disk each node is written in pre-order as
+        - NUL terminated path component (empty for the root)
+        - ASCII entry count, a space, ASCII subtree count and a newline
+        - 20 bytes tree SHA-1, only when the entry count is not -1
+    """
+
+    entry_count: int = -1
+    oid: str | None = None
+    children: dict[str, "CacheTree"] = field(default_factory=dict)
+
+    SIGNATURE = b"TREE"
+
+    @property
+    def valid(self) -> bool:
+        return self.entry_count >= 0
+
+    def invalidate(self, path: str):
+        """Invalidate the root and every directory containing `path`"""
+        node = self
+        node.entry_count = -1
+        for part in path.split("/")[:-1]:
+            node = node.children.get(part)
+            if node is None:
+                return
+            node.entry_count = -1
+
+    def find(self, dir_path: str) -> "CacheTree | None":
+        node = self
+        for part in filter(None, dir_path.split("/")):
+            node = node.children.get(part)
+            if node is None:
+                return None
+        return node
+
+    def __bytes__(self):
+        return self._serialize("")
+
+    def _serialize(self, name: str) -> bytes:
+        data = b"%s\x00%d %d\n" % (name.encode(), self.entry_count, len(self.children))
+        if self.valid:
+            data += bytes.fromhex(self.oid)
+        for child_name, child in sorted(self.children.items()):
+            data += child._serialize(child_name)
+        return data
+
+    @classmethod
+    def from_raw(cls, raw) -> "CacheTree":
+        tree, _, _ = cls._parse(raw, 0)
+        return tree
+
+    @classmethod
+    def _parse(cls, raw, offset: int) -> ("CacheTree", str, int):
+        name_end = bytes(raw[offset : offset + 4096]).index(b"\x00") + offset
+        name = bytes(raw[offset:name_end]).decode()
+        line_end = bytes(raw[name_end : name_end + 32]).index(b"\n") + name_end
+        entry_count, subtree_count = map(int, bytes(raw[name_end + 1 : line_end]).split(b" "))
+        offset = line_end + 1
+
+        tree = CacheTree(entry_count=entry_count)
+        if tree.valid:
+            tree.oid = bytes(raw[offset : offset + 20]).hex()
+            offset += 20
+        for _ in range(subtree_count):
+            child, child_name, offset = cls._parse(raw, offset)
+            tree.children[child_name] = child
+        return tree, name, offset
@@ -1,44 +1,94 @@
+import os
 from pathlib import Path
 
 from pit.commands.base import BaseCommand
-from pit.git_object import Blob
+from pit.exceptions import IndexLocked
+from pit.index import IndexEntry
+from pit.process_pool import run_batches, worker_database
 from pit.values import GitPath
 
 
+def store_files(
+    root_dir: str, quarantine: str, paths: list[str]
+) -> list[(str, str, os.stat_result)]:
+    """Hash and compress files, in a worker process when the pool is used"""
+    database = worker_database(root_dir, quarantine)
+    stored = []
+    for path in paths:
+        oid, file_stat = database.store_file(Path(root_dir) / path)
+        stored.append((path, oid, file_stat))
+    return stored
+
+
 class AddCommand(BaseCommand):
-    def __init__(self, root_dir: str, *, paths: list[str]):
+    def __init__(self, root_dir: str, *, paths: list[str], jobs: int = None):
         super().__init__(root_dir)
         self.paths = paths
+        self.jobs = jobs or self.repo.config.get_int("add.jobs", os.cpu_count() or 1)
 
     def run(self):
         if not self.paths:
             return
         for path in self.paths:
             git_path = GitPath(path, self.root_dir)
-            if not git_path.path.exists() and str(git_path) not in self.repo.index.entries:
+            if not git_path.path.exists() and not self.repo.index.has_tracked(path):
                 print(f"fatal: pathspec '{path}' did not match any files")
                 return
 
+        files = []
         for path in self.paths:
             path = Path(path)
             if not path.exists():
-                self.repo.index.remove_file(path)
                 continue
             if path.is_dir():
-                for sub_path in path.rglob("*"):
-                    if self._should_ignore(sub_path):
-                        continue
-                    if sub_path.is_file():
-                        self.repo.database.store(Blob(sub_path.read_bytes()))
-                        self.repo.index.add_file(sub_path)
+                files.extend(self._walk(str(GitPath(path, self.root_dir).path)))
             else:
-                self.repo.database.store(Blob(path.read_bytes()))
-                self.repo.index.add_file(path)
+                files.append(str(GitPath(path, self.root_dir).path))
 
-        for deleted in self.repo.status.workspace_deleted:
-            self.repo.index.remove_file(deleted)
-        self.repo.database.store_index(self.repo.index)
+        # every file is read exactly once, the index is updated in one batch afterwards
+        with self.repo.database.transaction():
+            stored = self._store_files(files)
+        for path, oid, file_stat in stored:
+            self.repo.index.add_entry(IndexEntry.from_stat(path, oid, file_stat))
+
+        # only the tracked files under the given paths can have been deleted
+        for path in self.paths:
+            prefix = GitPath(path, self.root_dir).path.as_posix()
+            for entry_path in list(
+                self.repo.index.tracked_paths.iter_prefix("" if prefix == "." else prefix)
+            ):
+                if os.path.lexists(self.root_dir / entry_path):
+                    continue
+                # a skip-worktree file is missing on purpose, it is outside the sparse checkout
+                if not self.repo.index.entries[entry_path].skip_worktree:
+                    self.repo.index.remove_file(self.root_dir / entry_path)
+        try:
+            self.repo.database.store_index(self.repo.index)
+        except IndexLocked as e:
+            print(e)
 
+    def _store_files(self, files: list[str]) -> list[(str, str, os.stat_result)]:
+        root_dir = str(self.root_dir.absolute())
+        quarantine = str(self.repo.database.quarantine.absolute())
+        return run_batches(store_files, (root_dir, quarantine), files, workers=self.jobs)
 
-    def _should_ignore(self, path: Path):
-        return any(ignore in path.parts for ignore in self.repo.ignores)
+    def _walk(self, dir_path: str) -> list[str]:
+        """Files below a directory, never descending into an ignored one"""
+        files = []
+        top = "" if dir_path == "." else dir_path
+        if top and self.repo.ignore.is_ignored(top, is_dir=True):
+            return files
+        for current, dir_names, file_names in os.walk(self.root_dir / top):
+            current = Path(current).relative_to(self.root_dir).as_posix()
+            current = "" if current == "." else current
+            dir_names[:] = [
+                name
+                for name in dir_names
+                if not self.repo.ignore.is_ignored(f"{current}/{name}".lstrip("/"), True)
+            ]
+            files.extend(
+                path
+                for path in (f"{current}/{name}".lstrip("/") for name in file_names)
+                if not self.repo.ignore.is_ignored(path)
+            )
+        return files
@@ -0,0 +1,50 @@
+import re
+import sys
+
+from pit.commands.base import BaseCommand
+from pit.exceptions import InvalidRevision, AmbiguousRevision, UnknownRevision
+from pit.git_object import Tree
+from pit.revesion import Revision
+from pit.values import GitFileMode
+
+
+class CatFileCommand(BaseCommand):
+    def __init__(self, root_dir: str, *, object: str, mode: str):
+        super().__init__(root_dir)
+        self.object = object
+        self.mode = mode
+
+    def run(self):
+        try:
+            oid = self._resolve()
+        except (InvalidRevision, AmbiguousRevision, UnknownRevision) as e:
+            print(e)
+            return
+
+        database = self.repo.database
+        match self.mode:
+            case "type":
+                print(database.read_header(oid)[0])
+            case "size":
+                print(database.read_header(oid)[1])
+            case "pretty":
+                if database.read_header(oid)[0] == "tree":
+                    tree: Tree = database.load(oid)
+                    for entry in tree.entries:
+                        type_ = "tree" if entry.is_dir() else "blob"
+                        mode = bytes(GitFileMode(entry.mode)).decode().rjust(6, "0")
+                        print(f"{mode} {type_} {entry.oid}\t{entry.path}")
+                else:
+                    content = database.read_raw(oid).split(b"\x00", 1)[1]
+                    sys.stdout.flush()
+                    sys.stdout.buffer.write(content)
+                    sys.stdout.buffer.flush()
+
+    def _resolve(self) -> str:
+        if re.fullmatch(r"[0-9a-f]{40}", self.object):
+            if not self.repo.database.has_exists(self.object):
+                raise InvalidRevision(self.object)
+            return self.object
+        if re.fullmatch(r"[0-9a-f]{4,39}", self.object):
+            return self.repo.database.prefix_match(self.object)
+        return Revision.resolve(self.object, repo=self.repo)
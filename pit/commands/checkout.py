@@ -1,18 +1,26 @@
+from pathlib import Path
+
 from pit.commands.base import BaseCommand
-from pit.exceptions import CheckoutConflict
+from pit.exceptions import CheckoutConflict, IndexLocked
 from pit.git_object import Commit
 from pit.migration import Migration
+from pit.repository import Repository
 from pit.revesion import Revision
 from pit.tree_diff import TreeDiff
 from pit.values import ObjectId
 
 
 class CheckoutCommand(BaseCommand):
-    def __init__(self, root_dir: str, *, revision: str):
+    def __init__(self, root_dir: str, *, revision: str, into: str = None):
         super().__init__(root_dir)
         self.revision = revision
+        self.into = into
 
     def run(self):
+        if self.into is not None:
+            self._checkout_into()
+            return
+
         head = self.repo.refs.read_head()
         before_commit = self.repo.database.load(head)
 
@@ -24,7 +32,7 @@ class CheckoutCommand(BaseCommand):
         )
         try:
             Migration(self.repo).apply(diff)
-        except CheckoutConflict as e:
+        except (CheckoutConflict, IndexLocked) as e:
             print(e)
             return
 
@@ -40,6 +48,39 @@ class CheckoutCommand(BaseCommand):
             self.repo.refs.update_head(oid=after_commit.oid)
             self._show_switch_to_detached_head_warning(after_commit)
 
+    def _checkout_into(self):
+        """
+        Populate a new worktree at `self.into` with the tree of a revision. The target
+        gets its own .git borrowing this repository's objects through an alternates
+        file, and since it starts out empty its files are written with no diff and no
+        conflict checks.
+        """
+        target = Path(self.into)
+        if target.exists() and not target.is_dir():
+            print(
+                f"fatal: destination path '{self.into}' already exists "
+                "and is not a directory."
+            )
+            return
+        if target.exists() and any(target.iterdir()):
+            print(
+                f"fatal: destination path '{self.into}' already exists "
+                "and is not an empty directory."
+            )
+            return
+        # like `git worktree add <path>`, the current commit unless told otherwise
+        oid = Revision.resolve(self.revision or "HEAD", repo=self.repo)
+        commit: Commit = self.repo.database.load(oid)
+
+        worktree = Repository(str(target))
+        worktree.database.init()
+        worktree.refs.init()
+        worktree.database.add_alternate(self.repo.database.objects_dir)
+        worktree.refs.update_head(oid=commit.oid)
+        flat_tree = self.repo.flat_trees.get(commit.tree_oid)
+        Migration(worktree, config=self.repo.config).populate(list(flat_tree.entries()))
+        print(f"HEAD is now at {ObjectId(commit.oid).short_id} {commit.message}")
+
     def _show_detached_head_warning(self, before_commit: Commit):
         print(
             f"""Previous HEAD position was {ObjectId(before_commit.oid).short_id} {before_commit.message}
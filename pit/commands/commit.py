@@ -1,11 +1,8 @@
-import os
 import time
-from collections import defaultdict
-from pathlib import Path
 
+from pit.cache_tree import CacheTree
 from pit.commands.base import BaseCommand
 from pit.git_object import Tree, TreeEntry, Commit
-from pit.index import IndexEntry
 from pit.values import GitFileMode, AuthorSign
 
 
@@ -19,50 +16,8 @@ class CommitCommand(BaseCommand):
         self.commit_msg = commit_msg
 
     def run(self):
-        # construct index tree
-        index_tree: dict[str, defaultdict | IndexEntry] = defaultdict(
-            lambda: defaultdict(dict)
-        )
-
-        def construct_tree(index_entry: IndexEntry):
-            path = Path(index_entry.file_path)
-
-            tree = index_tree
-            for part in path.parent.parts:
-                tree = tree[part]
-            tree[path.name] = index_entry
-
-        for index_entry in self.repo.index.entries.values():
-            construct_tree(index_entry)
-
-        # save git tree object
-        trees = []
-
-        def construct_tree_object(
-            root: dict[str, dict | IndexEntry],
-            tree: Tree | None,
-            parents: list[str],
-        ):
-            if isinstance(root, IndexEntry):
-                tree.entries.append(root.to_tree_entry())
-                return tree
-
-            sub_tree = Tree(entries=[])
-            for part in root:
-                construct_tree_object(root[part], sub_tree, parents=[*parents, part])
-            # Save later for same tree detection when implementing "nothing to commit, working tree clean"
-            trees.append(sub_tree)
-            tree.entries.append(
-                TreeEntry(
-                    oid=sub_tree.oid,
-                    path=os.path.join(*parents),
-                    mode=GitFileMode.dir(),
-                )
-            )
-            return tree
-
-        root_tree = construct_tree_object(index_tree, Tree(entries=[]), parents=[""])
-        tree_oid = root_tree.entries[0].oid
+        trees: list[Tree] = []
+        tree_oid = self._write_tree(trees)
         if (
             self.repo.database.has_exists(tree_oid)
             # Also diff from the previous commit's tree oid
@@ -72,9 +27,6 @@ class CommitCommand(BaseCommand):
             print("nothing to commit, working tree clean")
             return
 
-        for tree in trees:
-            self.repo.database.store(tree)
-
         commit = Commit(
             tree_oid=tree_oid,
             author=AuthorSign(
@@ -86,5 +38,50 @@ class CommitCommand(BaseCommand):
             message=self.commit_msg,
             parent_oid=self.repo.refs.read_head(),
         )
-        self.repo.database.store(commit)
+        # the ref is only moved once every object it points to is on disk
+        with self.repo.database.transaction():
+            for tree in trees:
+                self.repo.database.store(tree)
+            self.repo.database.store(commit)
         self.repo.refs.update_ref_head(commit.oid)
+        # keep the refreshed cached trees for the next commit
+        self.repo.database.store_index(self.repo.index, refresh_only=True)
+
+    def _write_tree(self, trees: list[Tree]) -> str:
+        """
+        Build the tree of every directory from the index, sorted by path so that each
+        directory covers a contiguous run of entries. A directory whose cached tree is
+        still valid is not rebuilt at all: its oid is reused and its whole run of entries
+        skipped. New trees are collected in `trees` and the cached trees refreshed.
+        """
+        paths = sorted(self.repo.index.entries)
+
+        def build(prefix: str, start: int, cache_tree: CacheTree) -> (str, int):
+            if cache_tree.valid:
+                return cache_tree.oid, start + cache_tree.entry_count
+
+            entries = []
+            children = {}
+            i = start
+            while i < len(paths) and paths[i].startswith(prefix):
+                name, _, rest = paths[i][len(prefix) :].partition("/")
+                if rest:
+                    child = cache_tree.children.get(name) or CacheTree()
+                    oid, i = build(f"{prefix}{name}/", i, child)
+                    children[name] = child
+                    entries.append(TreeEntry(oid=oid, path=name, mode=GitFileMode.dir()))
+                else:
+                    index_entry = self.repo.index.entries[paths[i]]
+                    entries.append(
+                        TreeEntry(oid=index_entry.oid, path=name, mode=index_entry.mode)
+                    )
+                    i += 1
+
+            tree = Tree(entries=entries)
+            trees.append(tree)
+            cache_tree.oid = tree.oid
+            cache_tree.entry_count = i - start
+            cache_tree.children = children
+            return cache_tree.oid, i
+
+        return build("", 0, self.repo.index.cache_tree)[0]
@@ -1,8 +1,10 @@
 import os
 import subprocess
 import sys
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from functools import cached_property
 from pathlib import Path
+from typing import Callable
 
 from pit.commands.base import BaseCommand
 from pit.constants import Color
@@ -21,42 +23,49 @@ class DiffEntry:
     file_path: str
     mode: str
     oid: str
-    data: bytes
+    # content is only read once hunks are shown, a mode-only change never reads it
+    read_data: Callable[[], bytes] = field(default=bytes, repr=False)
+
+    @cached_property
+    def data(self) -> bytes:
+        return self.read_data()
+
+    @staticmethod
+    def _read_blob(oid: str, database: Database) -> bytes:
+        # straight from the object stream, no Blob to build and rehash
+        with database.open_stream(oid) as stream:
+            return stream.read()
 
     @classmethod
     def from_index_entry(
         cls, index_entry: IndexEntry, database: Database
     ) -> "DiffEntry":
-        # noinspection PyUnresolvedReferences
-        data = (
-            database.load(index_entry.oid).content
-            if database.has_exists(index_entry.oid)
-            else Path(index_entry.file_path).read_bytes()
-        )
+        def read_data() -> bytes:
+            if database.has_exists(index_entry.oid):
+                return cls._read_blob(index_entry.oid, database)
+            return Path(index_entry.file_path).read_bytes()
+
         return DiffEntry(
             file_path=index_entry.file_path,
             mode=bytes(GitFileMode(index_entry.mode)).decode(),
             oid=index_entry.oid,
-            data=data,
+            read_data=read_data,
         )
 
     @classmethod
     def from_tree_entry(cls, tree_entry: TreeEntry, database: Database) -> "DiffEntry":
-        # noinspection PyUnresolvedReferences
         return DiffEntry(
             file_path=tree_entry.path,
             mode=bytes(GitFileMode(tree_entry.mode)).decode(),
             oid=tree_entry.oid,
-            data=database.load(tree_entry.oid).content,
+            read_data=lambda: cls._read_blob(tree_entry.oid, database),
         )
 
     @classmethod
     def from_deleted(
         cls,
     ) -> "DiffEntry":
-        return DiffEntry(
-            file_path=cls.DELETED_PATH, mode="", oid=cls.DELETED_OID, data=b""
-        )
+        return DiffEntry(file_path=cls.DELETED_PATH, mode="", oid=cls.DELETED_OID)
 
     @property
     def short_oid(self) -> str:
@@ -71,6 +80,8 @@ class DiffEntry:
 class DiffHeader:
     a_file: DiffEntry
     b_file: DiffEntry
+    # diff.linearSpace: find the edits with Diff.linear_diff, same output in O(n + m) memory
+    linear_space: bool = False
 
     def display(self):
         a_file_path = (
@@ -100,7 +111,8 @@ class DiffHeader:
         print(
             f"{color_prefix}+++ {'b/' if self.b_file.exists else ''}{self.b_file.file_path}{Color.RESET_ALL}"
         )
-        for hunk in Hunk.filters(Diff.from_lines(self.a_file.data, self.b_file.data).diff()):
+        diff = Diff.from_lines(self.a_file.data, self.b_file.data)
+        for hunk in Hunk.filters(diff.linear_diff() if self.linear_space else diff.diff()):
             print(hunk.header())
             for edit in hunk.edits:
                 print(edit)
@@ -110,6 +122,7 @@ class DiffCommand(BaseCommand):
     def __init__(self, root_dir: str, *, cached: bool):
         super().__init__(root_dir)
         self.cached = cached
+        self.linear_space = self.repo.config.get_bool("diff.linearSpace", False)
 
     def run(self):
         if self.cached:
@@ -141,6 +154,7 @@ class DiffCommand(BaseCommand):
                 b_file=DiffEntry.from_index_entry(index_entry, self.repo.database)
                 if index_entry
                 else DiffEntry.from_deleted(),
+                linear_space=self.linear_space,
             ).display()
 
     def _diff_index_workspace(self):
@@ -159,4 +173,5 @@ class DiffCommand(BaseCommand):
                 b_file=DiffEntry.from_index_entry(workspace_entry, self.repo.database)
                 if workspace_entry
                 else DiffEntry.from_deleted(),
+                linear_space=self.linear_space,
             ).display()
@@ -0,0 +1,52 @@
+import subprocess
+import sys
+import time
+
+from pit import fsmonitor
+from pit.commands.base import BaseCommand
+from pit.fsmonitor import FSMonitorDaemon
+
+START_TIMEOUT = 5.0
+
+
+class FSMonitorCommand(BaseCommand):
+    def __init__(self, root_dir: str, *, action: str):
+        super().__init__(root_dir)
+        self.action = action
+        self.git_dir = self.root_dir / ".git"
+
+    def run(self):
+        match self.action:
+            case "start":
+                self._start()
+            case "stop":
+                if fsmonitor.request(self.git_dir, {"stop": True}) is None:
+                    print("fsmonitor daemon is not running")
+            case "status":
+                response = fsmonitor.request(self.git_dir, {"status": True})
+                if response is None:
+                    print("fsmonitor daemon is not running")
+                else:
+                    print(f"fsmonitor daemon is watching {response['watches']} directories")
+            case "run":
+                FSMonitorDaemon(self.root_dir).run()
+
+    def _start(self):
+        if fsmonitor.request(self.git_dir, {"status": True}) is not None:
+            print("fsmonitor daemon is already running")
+            return
+        subprocess.Popen(
+            [sys.executable, sys.argv[0], "fsmonitor", "run"],
+            cwd=self.root_dir,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+        deadline = time.time() + START_TIMEOUT
+        while time.time() < deadline:
+            if fsmonitor.request(self.git_dir, {"status": True}) is not None:
+                print("fsmonitor daemon started, set core.fsmonitor = true to use it")
+                return
+            time.sleep(0.05)
+        print("fsmonitor daemon did not start")
@@ -0,0 +1,121 @@
+import time
+
+from pit.commands.base import BaseCommand
+from pit.database import parse_header
+from pit.exceptions import UnsupportedObjectType
+from pit.git_object import Tree
+from pit.pack import MAX_DELTA_DEPTH, PackedObject, PackIndex, PackWriter
+
+# submodule commits live in another repository, trees only record their oid
+GITLINK_MODE = 0o160000
+
+
+class RepackCommand(BaseCommand):
+    def __init__(self, root_dir: str, *, window: int = None, depth: int = None):
+        super().__init__(root_dir)
+        config = self.repo.config
+        self.window = window if window is not None else config.get_int("pack.window", 10)
+        self.depth = depth if depth is not None else config.get_int("pack.depth", MAX_DELTA_DEPTH)
+
+    def run(self):
+        started = time.time()
+        try:
+            objects = self._reachable_objects()
+        except UnsupportedObjectType as e:
+            print(e)
+            return
+        if not objects:
+            print("Nothing new to pack.")
+            return
+
+        database = self.repo.database
+        old_packs = database.packs.packs
+        writer = PackWriter(
+            database.pack_dir, self._load_content, window=self.window, depth=self.depth
+        )
+        pack_path = writer.write(list(objects.values()))
+
+        # an old pack may hold objects nothing points at any more, keep it then
+        new_index = PackIndex(pack_path.with_suffix(".idx"))
+        old_packs = [old_pack for old_pack in old_packs if old_pack.pack.path != pack_path]
+        removable = [
+            old_pack.pack.path
+            for old_pack in old_packs
+            if all(new_index.find(oid) is not None for oid in old_pack.index)
+        ]
+        new_index.close()
+        for old_pack in removable:
+            old_pack.with_suffix(".idx").unlink(missing_ok=True)
+            old_pack.unlink(missing_ok=True)
+        database.packs.reload()
+        pruned = database.prune_loose(set(objects))
+
+        kept = len(old_packs) - len(removable)
+        print(
+            f"Packed {len(objects)} objects ({writer.deltas} deltas) into {pack_path.name}\n"
+            f"Pack size: {pack_path.stat().st_size} bytes, "
+            f"pruned {pruned} loose objects, done in {time.time() - started:.2f}s"
+        )
+        if kept:
+            print(f"Kept {kept} old packs holding unreachable objects")
+
+    def _load_content(self, oid: str) -> bytes:
+        return self.repo.database.read_raw(oid).split(b"\x00", 1)[1]
+
+    def _reachable_objects(self) -> dict[str, PackedObject]:
+        """Everything reachable from HEAD, every ref and the index"""
+        database = self.repo.database
+        objects: dict[str, PackedObject] = {}
+
+        def add(oid: str, name: str = "") -> (str, bytes):
+            raw = database.read_raw(oid)
+            type_, size = parse_header(raw)
+            objects[oid] = PackedObject(oid, type_, size, name)
+            return type_, raw
+
+        def add_blob(oid: str, name: str):
+            # blobs are never walked into, their header is all we need
+            type_, size = database.read_header(oid)
+            objects[oid] = PackedObject(oid, type_, size, name)
+
+        refs = self.repo.refs
+        pending = [(oid, "") for oid in [refs.read_head(), *refs.list_refs().values()] if oid]
+        while pending:
+            oid, name = pending.pop()
+            if oid in objects:
+                continue
+            type_, raw = add(oid, name)
+            match type_:
+                case "commit" | "tag":
+                    pending.extend((linked, "") for linked in _header_links(raw))
+                case "tree":
+                    for entry in Tree.from_raw(raw).entries:
+                        if entry.mode == GITLINK_MODE or entry.oid in objects:
+                            continue
+                        if entry.is_dir():
+                            pending.append((entry.oid, entry.path))
+                        else:
+                            add_blob(entry.oid, entry.path)
+                case "blob":
+                    pass
+                case _:
+                    raise UnsupportedObjectType(oid, type_)
+
+        for entry in self.repo.index.entries.values():
+            if entry.oid not in objects and database.has_exists(entry.oid):
+                add_blob(entry.oid, entry.file_path.rsplit("/", 1)[-1])
+        return objects
+
+
+def _header_links(raw: bytes) -> list[str]:
+    """
+    Oids named in the header of a commit (its tree and every parent) or of an
+    annotated tag (the tagged object), the header ending at the first blank line.
+    """
+    header = raw.split(b"\x00", 1)[1].split(b"\n\n", 1)[0]
+    links = []
+    for line in header.split(b"\n"):
+        key, _, value = line.partition(b" ")
+        if key in (b"tree", b"parent", b"object"):
+            links.append(value.decode())
+    return links
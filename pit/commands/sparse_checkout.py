@@ -0,0 +1,49 @@
+from pit.commands.base import BaseCommand
+from pit.exceptions import IndexLocked
+from pit.migration import Migration
+from pit.sparse_checkout import SPARSE_CHECKOUT_FILE, SparseCheckout
+
+
+class SparseCheckoutCommand(BaseCommand):
+    def __init__(self, root_dir: str, *, action: str, dirs: list[str]):
+        super().__init__(root_dir)
+        self.action = action
+        self.dirs = [SparseCheckout.normalize(d) for d in dirs]
+        self.git_dir = self.root_dir / ".git"
+
+    def run(self):
+        if any(d in ("", ".") or d.startswith("..") for d in self.dirs):
+            print("fatal: sparse-checkout directories must be inside the repository")
+            return
+        current = self.repo.sparse_checkout
+        match self.action:
+            case "list":
+                if current is None:
+                    print("fatal: this worktree is not sparse")
+                    return
+                for dir_path in sorted(current.dirs):
+                    print(dir_path)
+            case "set":
+                self._update(SparseCheckout(dirs=set(self.dirs)))
+            case "add":
+                if current is None:
+                    print("fatal: no sparse-checkout to add to")
+                    return
+                self._update(SparseCheckout(dirs=current.dirs | set(self.dirs)))
+            case "disable":
+                self._update(None)
+
+    def _update(self, sparse: SparseCheckout | None):
+        try:
+            kept = Migration(self.repo).update_sparse(sparse)
+        except IndexLocked as e:
+            print(e)
+            return
+        if sparse is None:
+            (self.git_dir / SPARSE_CHECKOUT_FILE).unlink(missing_ok=True)
+        else:
+            sparse.store(self.git_dir)
+        if kept:
+            print("warning: the following paths have local changes and are not removed:")
+            for path in kept:
+                print(f"    {path}")
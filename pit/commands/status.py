@@ -15,6 +15,10 @@ class StatusCommand(BaseCommand):
             if self.porcelain
             else self._display_long_format(self.repo.status)
         )
+        # like git, keep the refreshed untracked cache and fsmonitor token for the next
+        # run, unless another command holds or has rewritten the index meanwhile
+        if self.repo.index_refreshed:
+            self.repo.database.store_index(self.repo.index, refresh_only=True)
 
     def _display_porcelain(self, status: FileStatusGroup) -> str:
         lines = []
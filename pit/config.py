@@ -0,0 +1,58 @@
+import re
+from pathlib import Path
+
+SECTION = re.compile(r'\[\s*([\w.-]+)(?:\s+"((?:[^"\\]|\\.)*)")?\s*\]')
+UNITS = {"k": 1024, "m": 1024**2, "g": 1024**3}
+
+
+class Config:
+    """
+    Read-only view of .git/config, addressed the way `git config` does it:
+    `section.key` or `section.subsection.key`, section and key case-insensitive.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._values = self._parse()
+
+    def get(self, key: str, default: str = None) -> str | None:
+        return self._values.get(self._normalize(key), default)
+
+    def get_int(self, key: str, default: int = None) -> int | None:
+        value = self.get(key)
+        if value is None:
+            return default
+        value = value.strip().lower()
+        if value and value[-1] in UNITS:
+            return int(value[:-1]) * UNITS[value[-1]]
+        return int(value)
+
+    def get_bool(self, key: str, default: bool = None) -> bool | None:
+        value = self.get(key)
+        if value is None:
+            return default
+        return value.strip().lower() in ("", "true", "yes", "on", "1")
+
+    @staticmethod
+    def _normalize(key: str) -> str:
+        section, _, name = key.rpartition(".")
+        head, dot, subsection = section.partition(".")
+        return f"{head.lower()}{dot}{subsection}.{name.lower()}"
+
+    def _parse(self) -> dict[str, str]:
+        if not self.path.exists():
+            return {}
+        values = {}
+        section = ""
+        for line in self.path.read_text().splitlines():
+            line = line.strip()
+            if not line or line[0] in "#;":
+                continue
+            if matched := SECTION.match(line):
+                name, subsection = matched.groups()
+                section = f"{name}.{subsection}" if subsection is not None else name
+                continue
+            key, _, value = line.partition("=")
+            value = value.split(" #")[0].split(" ;")[0].strip().strip('"')
+            values[self._normalize(f"{section}.{key.strip()}")] = value
+        return values
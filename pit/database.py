@@ -1,75 +1,484 @@
+from contextlib import contextmanager
 from dataclasses import dataclass
 from functools import cached_property
 from pathlib import Path
+import atexit
+import hashlib
+import os
+import re
+import shutil
+import sys
+import tempfile
 import zlib
 
-from pit.exceptions import InvalidRevision, AmbiguousRevision
-from pit.git_object import GitObject, Tree, Commit, Blob
+from pit.cache import ObjectCache
+from pit.config import Config
+from pit.exceptions import (
+    InvalidRevision,
+    AmbiguousRevision,
+    FileChangedWhileReading,
+    IndexLocked,
+)
+from pit.git_object import CHUNK_SIZE, GitObject, Tree, Commit, Blob
 from pit.index import Index
+from pit.pack import DELTA_BASE_CACHE_LIMIT, PackStore
+from pit.stream import ObjectStream, inflate_chunks
+
+OBJECT_CACHE_LIMITS = {
+    "commit": 16 * 1024 * 1024,
+    "tree": 32 * 1024 * 1024,
+    "blob": 16 * 1024 * 1024,
+}
+
+
+# "commit 4294967296\x00" is the longest header we expect to see
+MAX_HEADER = 32
+
+
+def parse_header(raw: bytes) -> (str, int):
+    """Parse `<type> <size>\x00` from the front of an object without touching the payload"""
+    end = raw.find(b"\x00", 0, MAX_HEADER)
+    if end == -1:
+        raise ValueError("malformed object header")
+    type_, size = raw[:end].split(b" ")
+    return type_.decode(), int(size)
+
+
+def parse_object(raw: bytes) -> GitObject:
+    match parse_header(raw)[0]:
+        case 'tree':
+            return Tree.from_raw(raw)
+        case 'commit':
+            return Commit.from_raw(raw)
+        case 'blob':
+            return Blob.from_raw(raw)
+        case _:
+            raise NotImplementedError
 
 
 @dataclass
 class ObjectPath:
     oid: str
     root_dir: Path
+    objects_dir: Path = None
 
     @cached_property
     def path(self) -> Path:
-        return self.root_dir / ".git/objects" / self.oid[:2] / self.oid[2:]
+        objects_dir = self.objects_dir or self.root_dir / ".git/objects"
+        return objects_dir / self.oid[:2] / self.oid[2:]
+
+    def read_raw(self) -> bytes:
+        return zlib.decompress(self.path.read_bytes())
+
+    def open_stream(self) -> ObjectStream:
+        f = open(self.path, "rb")
+        try:
+            return ObjectStream.from_loose(
+                inflate_chunks(lambda: f.read(CHUNK_SIZE)), on_close=f.close
+            )
+        except BaseException:
+            f.close()
+            raise
+
+    def read_header(self) -> (str, int):
+        """Inflate just enough of the object to see its header"""
+        decompressor = zlib.decompressobj()
+        head = b""
+        with open(self.path, "rb") as f:
+            while b"\x00" not in head:
+                if len(head) > MAX_HEADER or decompressor.eof:
+                    raise ValueError(f"malformed object header: {self.oid}")
+                compressed = decompressor.unconsumed_tail or f.read(MAX_HEADER)
+                if not compressed:
+                    raise ValueError(f"truncated object: {self.oid}")
+                head += decompressor.decompress(compressed, MAX_HEADER)
+        return parse_header(head)
 
     def load(self) -> GitObject:
-        raw = zlib.decompress(self.path.read_bytes())
-        match raw.split(b' ')[0]:
-            case b'tree':
-                return Tree.from_raw(raw)
-            case b'commit':
-                return Commit.from_raw(raw)
-            case b'blob':
-                return Blob.from_raw(raw)
-            case _:
-                raise NotImplementedError
+        return parse_object(self.read_raw())
+
+
+def fsync_path(path: Path):
+    """fsync a file or a directory by path"""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
 
 
 class Database:
-    def __init__(self, root_dir: Path):
+    def __init__(
+        self,
+        root_dir: Path,
+        config: Config = None,
+        *,
+        quarantine: Path = None,
+        objects_dir: Path = None,
+    ):
+        """
+        :param quarantine: join the object transaction whose objects are being staged in
+            this directory, e.g. from a worker process started inside `transaction()`
+        :param objects_dir: object store to use instead of the repository's own, e.g.
+            an alternate, which may be any objects directory, bare repositories included
+        """
+        self.quarantine = quarantine
         self.root_dir = root_dir
         self.git_dir = self.root_dir / ".git"
-        self.objects_dir = self.git_dir / "objects"
+        self.config = config or Config(self.git_dir / "config")
+        self.objects_dir = objects_dir or self.git_dir / "objects"
         self.index_path = self.git_dir / "index"
+        self.index_lock_path = self.git_dir / "index.lock"
+        # descriptor of index.lock while `lock_index` holds it and nothing stored it yet
+        self._index_lock: int | None = None
+        self.pack_dir = self.objects_dir / "pack"
+
+    @cached_property
+    def objects(self) -> ObjectCache:
+        """
+        Decoded objects shared between callers, which must treat them as read-only.
+        Budgets come from cache.commitLimit / cache.treeLimit / cache.blobLimit;
+        set PIT_TRACE_CACHE=1 to print hit/miss counters on exit.
+        """
+        cache = ObjectCache(
+            {
+                type_: self.config.get_int(f"cache.{type_}Limit", limit)
+                for type_, limit in OBJECT_CACHE_LIMITS.items()
+            }
+        )
+        if os.getenv("PIT_TRACE_CACHE"):
+            atexit.register(self._trace_cache, cache)
+        return cache
+
+    @staticmethod
+    def _trace_cache(cache: ObjectCache):
+        for type_, stats in cache.stats.items():
+            print(
+                f"object cache {type_}: {stats['hits']} hits, {stats['misses']} misses, "
+                f"{stats['entries']} entries, {stats['bytes']}/{stats['limit']} bytes",
+                file=sys.stderr,
+            )
+
+    @cached_property
+    def packs(self) -> PackStore:
+        return PackStore(
+            self.pack_dir,
+            delta_base_cache_limit=self.config.get_int(
+                "core.deltaBaseCacheLimit", DELTA_BASE_CACHE_LIMIT
+            ),
+        )
+
+    @cached_property
+    def alternates(self) -> list["Database"]:
+        """
+        Object stores listed in objects/info/alternates, one objects directory per line,
+        whose objects are readable from here as if they were local, e.g. the repository
+        a `checkout --into` worktree was populated from. Like git, a relative entry is
+        relative to this objects directory. An alternate is opened as a bare object
+        store, read with this repository's config.
+        """
+        try:
+            lines = (self.objects_dir / "info/alternates").read_text().splitlines()
+        except FileNotFoundError:
+            return []
+        return [
+            Database(
+                self.root_dir,
+                self.config,
+                objects_dir=(self.objects_dir / line.strip()).resolve(),
+            )
+            for line in lines
+            if line.strip() and not line.startswith("#")
+        ]
+
+    def add_alternate(self, objects_dir: Path):
+        alternates_path = self.objects_dir / "info/alternates"
+        alternates_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(alternates_path, "a") as f:
+            f.write(f"{objects_dir.absolute()}\n")
+        self.__dict__.pop("alternates", None)
 
     def init(self):
         self.objects_dir.mkdir(parents=True, exist_ok=True)
 
     def has_exists(self, object_id: str) -> bool:
-        return ObjectPath(object_id, self.root_dir).path.exists()
+        return (
+            self.packs.has(object_id)
+            or self._object_path(object_id).path.exists()
+            or self._find_alternate(object_id) is not None
+        )
 
-    def store(self, obj: GitObject):
-        object_path = ObjectPath(obj.oid, self.root_dir).path
-        if object_path.exists():
+    def _find_alternate(self, object_id: str) -> "Database | None":
+        for alternate in self.alternates:
+            if alternate.has_exists(object_id):
+                return alternate
+        return None
+
+    def _object_path(self, object_id: str) -> ObjectPath:
+        """Objects staged by the running transaction are visible before they are migrated"""
+        if self.quarantine:
+            staged = ObjectPath(object_id, self.root_dir, self.quarantine)
+            if staged.path.exists():
+                return staged
+        return ObjectPath(object_id, self.root_dir, self.objects_dir)
+
+    @contextmanager
+    def transaction(self):
+        """
+        Batch object writes so that they are both crash-safe and cheap.
+
+        Inside the transaction every object goes to a temp file that is renamed into a
+        quarantine directory under .git/objects, without any fsync. When the block exits
+        normally, the staged files are fsynced in one pass, the objects are renamed into
+        place and each touched directory is fsynced once, so a crash never leaves a torn
+        object behind and a batch costs no directory fsync per object. Only the staged
+        files are flushed, never the rest of the filesystem, let alone other ones as
+        os.sync() would. Nested transactions join the outermost one.
+        """
+        if self.quarantine:
+            yield
+            return
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+        self.quarantine = Path(tempfile.mkdtemp(prefix="incoming-", dir=self.objects_dir))
+        try:
+            yield
+            self._migrate_quarantine()
+        finally:
+            shutil.rmtree(self.quarantine, ignore_errors=True)
+            self.quarantine = None
+
+    def _migrate_quarantine(self):
+        staged = list(self.quarantine.glob("??/*"))
+        if not staged:
             return
+        for path in staged:
+            fsync_path(path)
+
+        touched = {self.objects_dir}
+        for path in staged:
+            object_path = self.objects_dir / path.parent.name / path.name
+            if object_path.exists():
+                continue
+            object_path.parent.mkdir(exist_ok=True)
+            os.replace(path, object_path)
+            touched.add(object_path.parent)
+        for directory in touched:
+            fsync_path(directory)
+
+    def _install(self, tmp_path: str, oid: str):
+        """
+        Rename a fully written temp file into place. Outside of a transaction the file
+        is fsynced first, so that the rename can never expose a torn object.
+        """
+        if self.has_exists(oid):
+            os.unlink(tmp_path)
+            return
+        if self.quarantine:
+            object_path = ObjectPath(oid, self.root_dir, self.quarantine).path
+        else:
+            object_path = ObjectPath(oid, self.root_dir, self.objects_dir).path
+            with open(tmp_path, "rb") as f:
+                os.fsync(f.fileno())
         object_path.parent.mkdir(parents=True, exist_ok=True)
-        object_path.write_bytes(zlib.compress(bytes(obj)))
+        os.replace(tmp_path, object_path)
+        if not self.quarantine:
+            fsync_path(object_path.parent)
+
+    def _tmp_object(self):
+        objects_dir = self.quarantine or self.objects_dir
+        objects_dir.mkdir(parents=True, exist_ok=True)
+        return tempfile.NamedTemporaryFile(dir=objects_dir, prefix="tmp_obj_", delete=False)
+
+    def store(self, obj: GitObject):
+        if self.has_exists(obj.oid):
+            return
+        with self._tmp_object() as tmp:
+            if isinstance(obj, Blob):
+                # compress header and content one after another instead of bytes(obj)
+                compressor = zlib.compressobj()
+                tmp.write(compressor.compress(obj.header))
+                tmp.write(compressor.compress(obj.content))
+                tmp.write(compressor.flush())
+            else:
+                tmp.write(zlib.compress(bytes(obj)))
+        self._install(tmp.name, obj.oid)
+
+    def store_file(self, path: Path) -> (str, os.stat_result):
+        """
+        Store a workspace file as a blob and return its oid, along with the stat data
+        taken before reading it, which is what an index entry for that oid must record.
+
+        The file is read once in CHUNK_SIZE pieces which feed both an incremental SHA-1
+        and a zlib.compressobj writing into a temp file under .git/objects, so peak
+        memory does not depend on the file size. The oid is only known at the end, so
+        the temp file is renamed into place afterwards, or dropped if it already exists.
+        """
+        tmp = self._tmp_object()
+        try:
+            with open(path, "rb") as f, tmp:
+                file_stat = os.fstat(f.fileno())
+                size = file_stat.st_size
+                header = Blob.header_of(size)
+                sha1 = hashlib.sha1(header)
+                compressor = zlib.compressobj()
+                tmp.write(compressor.compress(header))
+                while chunk := f.read(CHUNK_SIZE):
+                    sha1.update(chunk)
+                    tmp.write(compressor.compress(chunk))
+                    size -= len(chunk)
+                tmp.write(compressor.flush())
+            if size:
+                raise FileChangedWhileReading(str(path))
+
+            oid = sha1.hexdigest()
+            self._install(tmp.name, oid)
+            return oid, file_stat
+        finally:
+            if os.path.exists(tmp.name):
+                os.unlink(tmp.name)
 
     def load(self, object_id: str) -> GitObject:
-        object_id = ObjectPath(object_id, self.root_dir)
-        return object_id.load()
+        obj = self.objects.get(object_id)
+        if obj is None:
+            raw = self.read_raw(object_id)
+            obj = parse_object(raw)
+            self.objects.put(object_id, obj, len(raw))
+        return obj
 
-    def prefix_match(self, prefix_oid: str) -> str:
-        if len(prefix_oid) < 2:
-            raise InvalidRevision(prefix_oid)
+    def read_raw(self, object_id: str) -> bytes:
+        """Packs first, since a cloned or gc'd repository keeps almost everything there"""
+        packed = self.packs.read(object_id, self._read_base)
+        if packed is not None:
+            type_, content = packed
+            return b"%s %d\x00%s" % (type_.encode(), len(content), content)
+        object_path = self._object_path(object_id)
+        if not object_path.path.exists() and (alternate := self._find_alternate(object_id)):
+            return alternate.read_raw(object_id)
+        return object_path.read_raw()
 
-        prefix_dir = self.objects_dir / prefix_oid[:2]
-        if not prefix_dir.exists():
+    def open_stream(self, object_id: str) -> ObjectStream:
+        """
+        File object over the content of an object, inflated in CHUNK_SIZE pieces.
+        Use it where the bytes are only copied somewhere, e.g. written to the workspace.
+        """
+        stream = self.packs.open_stream(object_id, self._read_base)
+        if stream is not None:
+            return stream
+        object_path = self._object_path(object_id)
+        if not object_path.path.exists() and (alternate := self._find_alternate(object_id)):
+            return alternate.open_stream(object_id)
+        return object_path.open_stream()
+
+    def read_header(self, object_id: str) -> (str, int):
+        """(type, size) of an object, without inflating its content"""
+        header = self.packs.read_header(object_id, self.read_header)
+        if header is not None:
+            return header
+        object_path = self._object_path(object_id)
+        if not object_path.path.exists() and (alternate := self._find_alternate(object_id)):
+            return alternate.read_header(object_id)
+        return object_path.read_header()
+
+    def _read_base(self, object_id: str) -> (str, bytes):
+        head, content = self.read_raw(object_id).split(b"\x00", 1)
+        return head.split(b" ")[0].decode(), content
+
+    def prefix_match(self, prefix_oid: str) -> str:
+        if len(prefix_oid) < 2 or not re.fullmatch(r"[0-9a-f]+", prefix_oid):
             raise InvalidRevision(prefix_oid)
 
-        objects = list(prefix_dir.glob(f'{prefix_oid[2:]}*'))
+        objects = self._prefix_objects(prefix_oid)
         if not objects:
             raise InvalidRevision(prefix_oid)
-        if len(objects) >=2 :
+        if len(objects) >= 2:
             raise AmbiguousRevision(prefix_oid)
 
-        return f'{prefix_oid[:2]}{objects[0].name}'
+        return objects.pop()
 
-    def store_index(self, index: Index):
+    def _prefix_objects(self, prefix_oid: str) -> set[str]:
+        objects = self.packs.prefix_match(prefix_oid)
+        prefix_dir = self.objects_dir / prefix_oid[:2]
+        if prefix_dir.exists():
+            objects.update(
+                f"{prefix_oid[:2]}{path.name}"
+                for path in prefix_dir.glob(f"{prefix_oid[2:]}*")
+            )
+        for alternate in self.alternates:
+            objects |= alternate._prefix_objects(prefix_oid)
+        return objects
+
+    def prune_loose(self, object_ids: set[str]) -> int:
+        """Remove the loose copies of objects that are now stored in a pack"""
+        pruned = 0
+        for object_id in object_ids:
+            object_path = ObjectPath(object_id, self.root_dir, self.objects_dir).path
+            if object_path.exists():
+                object_path.unlink()
+                pruned += 1
+                if not any(object_path.parent.iterdir()):
+                    object_path.parent.rmdir()
+        return pruned
+
+    @contextmanager
+    def lock_index(self):
+        """
+        Hold index.lock for the whole block, like git's hold_locked_index before a
+        checkout touches the workspace: a held lock raises IndexLocked before anything
+        changed. The lock is created exclusively, so two writers never share it, and
+        `store_index` inside the block writes through it. When the block fails or never
+        stores the index, the lock is released and the index left as it was. Nested
+        blocks join the outermost one.
+        """
+        if self._index_lock is not None:
+            yield
+            return
         self.index_path.parent.mkdir(parents=True, exist_ok=True)
-        self.index_path.write_bytes(bytes(index))
+        try:
+            self._index_lock = os.open(
+                self.index_lock_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666
+            )
+        except FileExistsError:
+            raise IndexLocked(str(self.index_lock_path))
+        try:
+            yield
+        finally:
+            if self._index_lock is not None:
+                os.close(self._index_lock)
+                self._index_lock = None
+                self.index_lock_path.unlink(missing_ok=True)
+
+    def store_index(self, index: Index, *, refresh_only: bool = False) -> bool:
+        """
+        Write the index into index.lock, then rename it over the index: a crash never
+        leaves a half-written index. The lock is the one `lock_index` holds, or else is
+        taken just for this write. With `refresh_only` the write only saves cached data
+        such as the untracked cache, so it is skipped instead when the lock is held by
+        another process or when the index was rewritten since `index` was read. Returns
+        whether the index was written.
+        """
+        if self._index_lock is None:
+            try:
+                with self.lock_index():
+                    return self.store_index(index, refresh_only=refresh_only)
+            except IndexLocked:
+                if refresh_only:
+                    return False
+                raise
+
+        fd, self._index_lock = self._index_lock, None
+        try:
+            # checked under the lock, no other writer can replace the index meanwhile
+            stale = refresh_only and index.is_stale()
+            if not stale:
+                index.smudge_racy_entries()
+            with open(fd, "wb") as f:
+                if not stale:
+                    f.write(bytes(index))
+            if stale:
+                self.index_lock_path.unlink()
+                return False
+            os.replace(self.index_lock_path, self.index_path)
+        except BaseException:
+            self.index_lock_path.unlink(missing_ok=True)
+            raise
+        return True
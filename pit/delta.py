@@ -0,0 +1,189 @@
+from functools import cached_property
+
+MIN_MATCH = 16
+MAX_COPY = 0x10000
+MAX_INSERT = 0x7F
+
+
+class DeltaIndex:
+    """
+    A delta source and its non-overlapping MIN_MATCH byte blocks, like git's
+    delta_index: built on first use and then reused for every target compared with
+    the same source, e.g. while the source stays in the pack window.
+    """
+
+    def __init__(self, source: bytes):
+        self.source = source
+
+    @cached_property
+    def blocks(self) -> dict[bytes, int]:
+        blocks = {}
+        source = self.source
+        for i in range(0, len(source) - MIN_MATCH + 1, MIN_MATCH):
+            blocks.setdefault(source[i : i + MIN_MATCH], i)
+        return blocks
+
+
+def encode_delta_size(size: int) -> bytes:
+    encoded = bytearray()
+    while True:
+        byte = size & 0x7F
+        size >>= 7
+        if size:
+            encoded.append(byte | 0x80)
+        else:
+            encoded.append(byte)
+            return bytes(encoded)
+
+
+def read_delta_size(delta: bytes, pos: int) -> (int, int):
+    """Little-endian base-128 varint used for the source / target sizes of a delta"""
+    size = shift = 0
+    while True:
+        byte = delta[pos]
+        pos += 1
+        size |= (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            return size, pos
+
+
+def apply_delta(base: bytes, delta: bytes) -> bytes:
+    """
+    delta 的格式
+        - source size (varint)
+        - target size (varint)
+        - 若干指令：
+            - 最高位为 1 表示 copy，低 4 位标记 offset 的字节，接下来 3 位标记 size 的字节
+            - 最高位为 0 表示 insert，低 7 位为紧随其后的字面量长度
+    """
+    source_size, pos = read_delta_size(delta, 0)
+    if source_size != len(base):
+        raise ValueError("delta source size mismatch")
+    target_size, pos = read_delta_size(delta, pos)
+
+    target = bytearray()
+    while pos < len(delta):
+        opcode = delta[pos]
+        pos += 1
+        if opcode & 0x80:
+            offset = size = 0
+            for i in range(4):
+                if opcode & (1 << i):
+                    offset |= delta[pos] << (8 * i)
+                    pos += 1
+            for i in range(3):
+                if opcode & (0x10 << i):
+                    size |= delta[pos] << (8 * i)
+                    pos += 1
+            target += base[offset : offset + (size or 0x10000)]
+        elif opcode:
+            target += delta[pos : pos + opcode]
+            pos += opcode
+        else:
+            raise ValueError("unexpected delta opcode 0")
+
+    if len(target) != target_size:
+        raise ValueError("delta target size mismatch")
+    return bytes(target)
+
+
+def create_delta(
+    source: bytes | DeltaIndex, target: bytes, max_size: int = None
+) -> bytes | None:
+    """
+    Encode `target` as copies from `source` plus literal inserts.
+
+    `source` is indexed by non-overlapping MIN_MATCH byte blocks, or comes as a
+    DeltaIndex holding them already; every position of `target` is probed against
+    that index and a hit is extended forwards as far as
+    the bytes agree. Returns None as soon as the delta, counting the literal bytes
+    not yet flushed, grows beyond `max_size`, so a dissimilar source is given up on
+    after about `max_size` bytes of `target` instead of after all of them.
+    """
+    if max_size is None:
+        max_size = len(target)
+    index = source if isinstance(source, DeltaIndex) else DeltaIndex(source)
+    source, blocks = index.source, index.blocks
+
+    delta = bytearray(encode_delta_size(len(source)) + encode_delta_size(len(target)))
+    insert_start = pos = 0
+    end = len(target)
+
+    def flush_insert(stop: int):
+        for start in range(insert_start, stop, MAX_INSERT):
+            literal = target[start : min(start + MAX_INSERT, stop)]
+            delta.append(len(literal))
+            delta.extend(literal)
+
+    while pos + MIN_MATCH <= end:
+        source_pos = blocks.get(target[pos : pos + MIN_MATCH])
+        if source_pos is None:
+            pos += 1
+            if len(delta) + pos - insert_start > max_size:
+                return None
+            continue
+
+        length = MIN_MATCH
+        while (
+            pos + length < end
+            and source_pos + length < len(source)
+            and target[pos + length] == source[source_pos + length]
+        ):
+            length += 1
+
+        flush_insert(pos)
+        for offset in range(0, length, MAX_COPY):
+            delta.extend(_copy_op(source_pos + offset, min(MAX_COPY, length - offset)))
+        pos += length
+        insert_start = pos
+        if len(delta) > max_size:
+            return None
+
+    flush_insert(end)
+    if len(delta) > max_size:
+        return None
+    return bytes(delta)
+
+
+def _copy_op(offset: int, size: int) -> bytes:
+    opcode = 0x80
+    args = bytearray()
+    for i in range(4):
+        byte = (offset >> (8 * i)) & 0xFF
+        if byte:
+            opcode |= 1 << i
+            args.append(byte)
+    # size 0x10000 is encoded by leaving every size byte out
+    if size != MAX_COPY:
+        for i in range(3):
+            byte = (size >> (8 * i)) & 0xFF
+            if byte:
+                opcode |= 0x10 << i
+                args.append(byte)
+    return bytes([opcode]) + bytes(args)
+
+
+if __name__ == "__main__":
+    import os
+    import random
+
+    print("Test apply_delta(create_delta(a, b)) round trip")
+    random.seed(0)
+    for _ in range(500):
+        source = os.urandom(random.randint(0, 4096))
+        target = bytearray(source)
+        for _ in range(random.randint(0, 10)):
+            start = random.randint(0, len(target))
+            target[start : start + random.randint(0, 64)] = os.urandom(random.randint(0, 64))
+        target = bytes(target)
+        delta = create_delta(source, target, max_size=10**9)
+        assert apply_delta(source, delta) == target
+
+    print("Test copies longer than MAX_COPY and inserts longer than MAX_INSERT")
+    source = os.urandom(3 * MAX_COPY)
+    target = source + os.urandom(3 * MAX_INSERT) + source[:100]
+    assert apply_delta(source, create_delta(source, target)) == target
+
+    print("Test a dissimilar source gives no delta")
+    assert create_delta(os.urandom(4096), os.urandom(4096), max_size=2048) is None
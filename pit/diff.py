@@ -109,6 +109,114 @@ class Diff:
                 yield (prev_x, prev_y), (x, y)
             x, y = prev_x, prev_y
 
+    def linear_diff(self) -> list[Edit]:
+        """
+        Same edits as `diff`, in linear space. `shortest_edit` keeps a copy of `v` for
+        every edit distance d so that `backtrack` can walk the path back, O((n + m) * D)
+        memory. Here the length D of the shortest edit script of a range comes from the
+        middle snake search of Myers' linear space refinement, the point halfway along
+        the path `diff` would take is found in one more forward pass, and both halves
+        are solved recursively. A part of that path is exactly the path `diff` takes on
+        the corresponding sub range, so the edits come out the same.
+        """
+        a = [line.text for line in self.a]
+        b = [line.text for line in self.b]
+        edits = []
+
+        def solve(a_lo: int, a_hi: int, b_lo: int, b_hi: int):
+            if a_lo == a_hi or b_lo == b_hi:
+                edits.extend(Edit("-", a_line=line, b_line=None) for line in self.a[a_lo:a_hi])
+                edits.extend(Edit("+", a_line=None, b_line=line) for line in self.b[b_lo:b_hi])
+                return
+            d = self._middle_snake(a, b, a_lo, a_hi, b_lo, b_hi)
+            if d <= 1:
+                # two rows of `v` at most, backtracking costs nothing here
+                part = Diff([], [])
+                part.a, part.b = self.a[a_lo:a_hi], self.b[b_lo:b_hi]
+                edits.extend(part.diff())
+                return
+            x, y = self._split_point(a, b, a_lo, a_hi, b_lo, b_hi, d)
+            solve(a_lo, a_lo + x, b_lo, b_lo + y)
+            solve(a_lo + x, a_hi, b_lo + y, b_hi)
+
+        solve(0, len(a), 0, len(b))
+        return edits
+
+    @staticmethod
+    def _middle_snake(a: list, b: list, a_lo: int, a_hi: int, b_lo: int, b_hi: int) -> int:
+        """
+        Length of the shortest edit script between two ranges. The search runs forwards
+        from the start and backwards from the end, keeping only the furthest x reached
+        on every diagonal k = x - y, until the two frontiers overlap halfway, so it
+        takes about half the steps of a forward search. For an odd `delta` they can
+        first meet after a forward step, for an even one after a backward step.
+        """
+        n, m = a_hi - a_lo, b_hi - b_lo
+        delta = n - m
+        max_ = (n + m + 1) // 2
+        offset = max_ + 1
+        forward = [0] * (2 * offset + 1)
+        backward = [0] * (2 * offset + 1)
+        for d in range(max_ + 1):
+            for k in range(-d, d + 1, 2):
+                if k == -d or (k != d and forward[offset + k - 1] < forward[offset + k + 1]):
+                    x = forward[offset + k + 1]
+                else:
+                    x = forward[offset + k - 1] + 1
+                y = x - k
+                while x < n and y < m and a[a_lo + x] == b[b_lo + y]:
+                    x, y = x + 1, y + 1
+                forward[offset + k] = x
+                # the backward search sees this diagonal as delta - k
+                if delta % 2 and -(d - 1) <= delta - k <= d - 1:
+                    if x + backward[offset + delta - k] >= n:
+                        return 2 * d - 1
+            for k in range(-d, d + 1, 2):
+                if k == -d or (k != d and backward[offset + k - 1] < backward[offset + k + 1]):
+                    x = backward[offset + k + 1]
+                else:
+                    x = backward[offset + k - 1] + 1
+                y = x - k
+                while x < n and y < m and a[a_hi - x - 1] == b[b_hi - y - 1]:
+                    x, y = x + 1, y + 1
+                backward[offset + k] = x
+                if not delta % 2 and -d <= delta - k <= d:
+                    if x + forward[offset + delta - k] >= n:
+                        return 2 * d
+
+    @staticmethod
+    def _split_point(
+        a: list, b: list, a_lo: int, a_hi: int, b_lo: int, b_hi: int, d_total: int
+    ) -> (int, int):
+        """
+        (x, y) relative to (a_lo, b_lo) where the path `diff` takes through the range
+        stands after d_total // 2 edits. The same forward search as `shortest_edit` is
+        run, but every diagonal carries the diagonal its path stood on after half the
+        edits instead of a copy of `v` per step; once the end is reached its label
+        tells which point of the saved halfway `v` the path went through.
+        """
+        n, m = a_hi - a_lo, b_hi - b_lo
+        half = d_total // 2
+        offset = d_total + 1
+        v = [0] * (2 * offset + 1)
+        labels = [0] * (2 * offset + 1)
+        halfway = None
+        for d in range(d_total + 1):
+            for k in range(-d, d + 1, 2):
+                if k == -d or (k != d and v[offset + k - 1] < v[offset + k + 1]):
+                    x, previous = v[offset + k + 1], k + 1
+                else:
+                    x, previous = v[offset + k - 1] + 1, k - 1
+                y = x - k
+                while x < n and y < m and a[a_lo + x] == b[b_lo + y]:
+                    x, y = x + 1, y + 1
+                v[offset + k] = x
+                labels[offset + k] = k if d == half else labels[offset + previous]
+            if d == half:
+                halfway = v.copy()
+        k = labels[offset + n - m]
+        return halfway[offset + k], halfway[offset + k] - k
+
     def shortest_edit_v2(self):
         n, m = len(self.a), len(self.b)
         max_ = n + m
@@ -152,6 +260,15 @@ if __name__ == "__main__":
     # for edit in Diff("ACCCAB", "ECCDAB").diff():
     #     print(edit)
 
+    print("Test linear_diff gives the same edits as diff")
+    import random
+
+    random.seed(0)
+    for _ in range(5000):
+        a = random.choices("ABC", k=random.randint(0, 12))
+        b = random.choices("ABC", k=random.randint(0 if a else 1, 12))
+        assert Diff(a, b).linear_diff() == Diff(a, b).diff(), (a, b)
+
 """
 - A
 - B
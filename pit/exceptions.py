@@ -55,3 +55,40 @@ class CheckoutConflict(PitError):
 {files}
 Please move or remove them before you switch branches.
 Aborting"""
+
+
+class FileChangedWhileReading(PitError):
+    def __init__(self, path: str):
+        self.path = path
+
+    def __str__(self):
+        return f"fatal: {self.path}: file changed as we read it"
+
+
+class UnsupportedObjectType(PitError):
+    def __init__(self, oid: str, type_: str):
+        self.oid = oid
+        self.type = type_
+
+    def __str__(self):
+        return f"fatal: object {self.oid} has unsupported type '{self.type}'"
+
+
+class IndexLocked(PitError):
+    def __init__(self, lock_path: str):
+        self.lock_path = lock_path
+
+    def __str__(self):
+        return f"""fatal: Unable to create '{self.lock_path}': File exists.
+
+Another pit process seems to be running in this repository. If it is gone,
+remove the file manually to continue."""
+
+
+class UnsupportedIndexExtension(PitError):
+    def __init__(self, signature: str):
+        self.signature = signature
+
+    def __str__(self):
+        return f"""error: index uses {self.signature} extension, which we do not understand
+fatal: index file corrupt"""
@@ -0,0 +1,118 @@
+import bisect
+import mmap
+import os
+import struct
+import tempfile
+from collections.abc import Mapping
+from pathlib import Path
+from typing import Callable, Iterable, Iterator
+
+from pit.git_object import TreeEntry
+
+# flat trees of the most recently used root trees kept on disk
+FLAT_TREE_CACHE_SIZE = 16
+
+
+class FlatTree(Mapping):
+    """
+    Read-only `path -> TreeEntry` view of every file below a root tree, memory-mapped
+    from a file written by `FlatTree.write`:
+        - 4 bytes signature PFLT, 4 bytes version, 4 bytes number of entries
+        - a 4 bytes offset per entry, entries sorted by path in index order
+        - for each entry, 20 bytes oid, 4 bytes mode and the NUL terminated path
+    Lookups bisect the offset table, nothing is decoded up front.
+    """
+
+    SIGNATURE = b"PFLT"
+    VERSION = 1
+    HEADER = struct.Struct(">4sII")
+    RECORD = struct.Struct(">20sI")
+
+    def __init__(self, path: Path):
+        with open(path, "rb") as f:
+            self._buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        signature, version, self._count = self.HEADER.unpack_from(self._buffer, 0)
+        if signature != self.SIGNATURE or version != self.VERSION:
+            raise ValueError(f"not a flat tree: {path}")
+
+    def __len__(self):
+        return self._count
+
+    def _offset(self, i: int) -> int:
+        start = self.HEADER.size + 4 * i
+        return int.from_bytes(self._buffer[start : start + 4], "big")
+
+    def _path_at(self, i: int) -> bytes:
+        start = self._offset(i) + self.RECORD.size
+        return self._buffer[start : self._buffer.find(b"\x00", start)]
+
+    def _entry_at(self, i: int, path: str) -> TreeEntry:
+        oid, mode = self.RECORD.unpack_from(self._buffer, self._offset(i))
+        return TreeEntry(oid=oid.hex(), path=path, mode=mode)
+
+    def _search(self, path: str) -> int:
+        key = path.encode()
+        return bisect.bisect_left(range(self._count), key, key=self._path_at)
+
+    def __getitem__(self, path: str) -> TreeEntry:
+        i = self._search(path)
+        if i < self._count and self._path_at(i) == path.encode():
+            return self._entry_at(i, path)
+        raise KeyError(path)
+
+    def __iter__(self) -> Iterator[str]:
+        for i in range(self._count):
+            yield self._path_at(i).decode()
+
+    def entries(self) -> Iterator[TreeEntry]:
+        for i in range(self._count):
+            yield self._entry_at(i, self._path_at(i).decode())
+
+    @classmethod
+    def write(cls, path: Path, entries: Iterable[TreeEntry]):
+        entries = sorted(entries, key=lambda e: e.path.encode())
+        records, offsets = [], []
+        offset = cls.HEADER.size + 4 * len(entries)
+        for entry in entries:
+            record = cls.RECORD.pack(bytes.fromhex(entry.oid), entry.mode)
+            record += entry.path.encode() + b"\x00"
+            offsets.append(offset.to_bytes(4, "big"))
+            records.append(record)
+            offset += len(record)
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=path.parent, prefix="tmp_", delete=False) as f:
+            f.write(cls.HEADER.pack(cls.SIGNATURE, cls.VERSION, len(entries)))
+            f.write(b"".join(offsets))
+            f.write(b"".join(records))
+        os.replace(f.name, path)
+
+
+class FlatTreeCache:
+    """
+    Flat trees under .git/flat-trees, one file per root tree oid. Nothing is written
+    ahead of time: the first `get` of a tree flattens its tree objects and writes the
+    file, later ones only memory-map it. Only the FLAT_TREE_CACHE_SIZE most recently
+    used ones are kept.
+    """
+
+    def __init__(self, git_dir: Path, flatten: Callable[[str], Iterable[TreeEntry]]):
+        self.cache_dir = git_dir / "flat-trees"
+        self._flatten = flatten
+
+    def get(self, tree_oid: str) -> FlatTree:
+        path = self.cache_dir / tree_oid
+        try:
+            flat_tree = FlatTree(path)
+            os.utime(path)
+            return flat_tree
+        except (FileNotFoundError, ValueError):
+            pass
+        self.put(tree_oid, self._flatten(tree_oid))
+        return FlatTree(path)
+
+    def put(self, tree_oid: str, entries: Iterable[TreeEntry]):
+        FlatTree.write(self.cache_dir / tree_oid, entries)
+        cached = sorted(self.cache_dir.iterdir(), key=lambda p: p.stat().st_mtime_ns)
+        for stale in cached[:-FLAT_TREE_CACHE_SIZE]:
+            stale.unlink(missing_ok=True)
@@ -0,0 +1,272 @@
+import ctypes
+import ctypes.util
+import json
+import os
+import selectors
+import socket
+import struct
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (
+    IN_MODIFY
+    | IN_ATTRIB
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+    | IN_MOVE_SELF
+    | IN_ONLYDIR
+)
+EVENT = struct.Struct("iIII")
+
+SOCKET_NAME = "fsmonitor.sock"
+# once the journal grows past this, the oldest half is dropped and older tokens go stale
+MAX_JOURNAL = 256 * 1024
+QUERY_TIMEOUT = 1.0
+
+
+class Inotify:
+    """The inotify(7) calls through ctypes, Linux only"""
+
+    def __init__(self):
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+    def add_watch(self, path: Path) -> int:
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed: {path}")
+        return wd
+
+    def read_events(self) -> list[(int, int, str)]:
+        """Every queued (wd, mask, name), without blocking"""
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return events
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = EVENT.unpack_from(data, offset)
+                offset += EVENT.size
+                name = data[offset : offset + length].rstrip(b"\x00")
+                offset += length
+                events.append((wd, mask, os.fsdecode(name)))
+
+    def close(self):
+        os.close(self.fd)
+
+
+@dataclass
+class FSMonitorState:
+    """
+    What `pit status` learned from the daemon, kept as an optional index extension:
+    the token of its last query and the tracked paths it found modified or deleted.
+    Any other tracked path was clean at that token, so as long as the daemon reports
+    nothing under it the path is still clean and is not even stat'ed. Adding or
+    removing an index entry marks its path dirty.
+
+        - NUL terminated token
+        - NUL terminated dirty paths until the end of the extension
+    """
+
+    token: str = ""
+    dirty: set[str] = field(default_factory=set)
+
+    SIGNATURE = b"PFSM"
+
+    def __bytes__(self):
+        return b"".join(b"%s\x00" % p.encode() for p in [self.token, *sorted(self.dirty)])
+
+    @classmethod
+    def from_raw(cls, raw) -> "FSMonitorState":
+        token, *dirty = bytes(raw).decode().split("\x00")[:-1]
+        return FSMonitorState(token=token, dirty=set(dirty))
+
+
+def socket_path(git_dir: Path) -> Path:
+    return git_dir / SOCKET_NAME
+
+
+def request(git_dir: Path, message: dict) -> dict | None:
+    """Send one request to the daemon, None when it is not running or does not answer"""
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.settimeout(QUERY_TIMEOUT)
+    try:
+        client.connect(str(socket_path(git_dir)))
+        client.sendall(json.dumps(message).encode() + b"\n")
+        response = b""
+        while chunk := client.recv(64 * 1024):
+            response += chunk
+        return json.loads(response)
+    except (OSError, ValueError):
+        return None
+    finally:
+        client.close()
+
+
+def query(git_dir: Path, token: str) -> tuple[str, set[str] | None] | None:
+    """
+    (new token, paths changed since `token`), paths being None when the token is stale
+    and everything has to be scanned. None when the daemon is not running.
+    """
+    response = request(git_dir, {"query": token})
+    if response is None:
+        return None
+    paths = response.get("paths")
+    return response["token"], None if paths is None else set(paths)
+
+
+class FSMonitorDaemon:
+    """
+    Watch every directory of the workspace but .git with inotify, and journal the
+    relative path of every changed entry. A token is `<daemon id>:<journal position>`;
+    querying with a token returns the paths journaled since then and a new token.
+    Tokens of another daemon, or older than the trimmed journal, are answered as stale.
+    """
+
+    def __init__(self, root_dir: Path):
+        self.root_dir = root_dir
+        self.git_dir = root_dir / ".git"
+        self.daemon_id = f"{os.getpid()}.{time.time_ns()}"
+        self.inotify = Inotify()
+        self.watches: dict[int, str] = {}
+        self.journal: list[str] = []
+        self.first_seq = 0
+        self.running = False
+
+    @property
+    def seq(self) -> int:
+        return self.first_seq + len(self.journal)
+
+    @property
+    def token(self) -> str:
+        return f"{self.daemon_id}:{self.seq}"
+
+    def run(self):
+        self._watch_tree("", record=False)
+        path = socket_path(self.git_dir)
+        path.unlink(missing_ok=True)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(str(path))
+        server.listen()
+
+        selector = selectors.DefaultSelector()
+        selector.register(self.inotify.fd, selectors.EVENT_READ, "inotify")
+        selector.register(server, selectors.EVENT_READ, "server")
+        self.running = True
+        try:
+            while self.running:
+                for key, _ in selector.select(timeout=60):
+                    if key.data == "inotify":
+                        self._drain()
+                    else:
+                        self._serve(server.accept()[0])
+                if not self.git_dir.exists():
+                    break
+        finally:
+            server.close()
+            path.unlink(missing_ok=True)
+            self.inotify.close()
+
+    def _serve(self, conn: socket.socket):
+        with conn:
+            conn.settimeout(QUERY_TIMEOUT)
+            try:
+                message = json.loads(conn.makefile("rb").readline())
+            except (OSError, ValueError):
+                return
+            # every change made before the request is already queued on the inotify fd
+            self._drain()
+            if "query" in message:
+                response = {"token": self.token, "paths": self._since(message["query"])}
+            elif "stop" in message:
+                self.running = False
+                response = {"token": self.token}
+            else:
+                response = {"token": self.token, "watches": len(self.watches)}
+            try:
+                conn.sendall(json.dumps(response).encode())
+            except OSError:
+                pass
+
+    def _since(self, token: str) -> list[str] | None:
+        daemon_id, _, seq = token.rpartition(":")
+        if daemon_id != self.daemon_id or not seq.isdigit() or int(seq) < self.first_seq:
+            return None
+        return sorted(set(self.journal[int(seq) - self.first_seq :]))
+
+    def _record(self, path: str):
+        self.journal.append(path)
+        if len(self.journal) > MAX_JOURNAL:
+            dropped = len(self.journal) // 2
+            self.journal = self.journal[dropped:]
+            self.first_seq += dropped
+
+    def _drain(self):
+        for wd, mask, name in self.inotify.read_events():
+            if mask & IN_Q_OVERFLOW:
+                # events were lost, no token handed out so far can be trusted
+                self.first_seq = self.seq + 1
+                self.journal = []
+                continue
+            dir_path = self.watches.get(wd)
+            if dir_path is None:
+                continue
+            if mask & IN_IGNORED:
+                self.watches.pop(wd)
+                continue
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                if dir_path:
+                    self._record(dir_path)
+                continue
+            path = f"{dir_path}/{name}" if dir_path else name
+            if path == ".git" or path.startswith(".git/"):
+                continue
+            self._record(path)
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                self._watch_tree(path)
+
+    def _watch_tree(self, dir_path: str, record: bool = True):
+        """
+        Watch a directory and everything below it. For a directory that just appeared,
+        entries created before the watch was in place would be missed otherwise, so each
+        one found here is journaled too.
+        """
+        pending = [dir_path]
+        while pending:
+            current = pending.pop()
+            try:
+                self.watches[self.inotify.add_watch(self.root_dir / current)] = current
+                entries = list(os.scandir(self.root_dir / current))
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            for entry in entries:
+                path = f"{current}/{entry.name}" if current else entry.name
+                if path == ".git":
+                    continue
+                if record:
+                    self._record(path)
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append(path)
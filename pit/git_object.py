@@ -1,9 +1,13 @@
 import hashlib
+import os
 from dataclasses import dataclass, field
 from pathlib import Path
 
+from pit.exceptions import FileChangedWhileReading
 from pit.values import GitFileMode, AuthorSign
 
+CHUNK_SIZE = 64 * 1024
+
 
 @dataclass
 class GitObject:
@@ -23,18 +27,43 @@ class Blob(GitObject):
 
     def __post_init__(self):
         self.type = "blob"
-        self.oid = hashlib.sha1(bytes(self)).hexdigest()
+        # hash header and content separately instead of building bytes(self)
+        sha1 = hashlib.sha1(self.header)
+        sha1.update(self.content)
+        self.oid = sha1.hexdigest()
+
+    @property
+    def header(self) -> bytes:
+        return self.header_of(len(self.content))
+
+    @staticmethod
+    def header_of(size: int) -> bytes:
+        return b"blob %d\x00" % size
+
+    @classmethod
+    def hash_file(cls, path: Path) -> (str, os.stat_result):
+        """
+        Blob oid of a file, read in CHUNK_SIZE pieces so memory stays flat, along with
+        the stat data taken before reading: stat data taken afterwards could already
+        describe a later version of the file than the one hashed.
+        """
+        with open(path, "rb") as f:
+            file_stat = os.fstat(f.fileno())
+            size = file_stat.st_size
+            sha1 = hashlib.sha1(cls.header_of(size))
+            while chunk := f.read(CHUNK_SIZE):
+                sha1.update(chunk)
+                size -= len(chunk)
+        if size:
+            raise FileChangedWhileReading(str(path))
+        return sha1.hexdigest(), file_stat
 
     @classmethod
     def from_raw(cls, raw: bytes) -> "Blob":
         return Blob(raw.split(b"\x00", 1)[1])
 
     def __bytes__(self):
-        return b"%s %d\x00%s" % (
-            self.type.encode(),
-            len(self.content),
-            self.content,
-        )
+        return b"%s%s" % (self.header, self.content)
 
 
 @dataclass()
@@ -0,0 +1,160 @@
+import re
+from dataclasses import dataclass
+from pathlib import Path
+
+from pit.constants import IGNORE
+
+IGNORE_FILE = ".gitignore"
+
+
+def translate(pattern: str) -> str:
+    """
+    Regex for a gitignore glob: `*` and `?` never match a `/`, `[...]` is a character
+    class, a `**` segment matches any number of directories and `\\` escapes a character
+    """
+    regex = []
+    i, n = 0, len(pattern)
+    while i < n:
+        at_segment_start = i == 0 or pattern[i - 1] == "/"
+        if at_segment_start and pattern.startswith("**/", i):
+            regex.append("(?:.*/)?")
+            i += 3
+        elif at_segment_start and pattern[i:] == "**":
+            regex.append(".*")
+            i += 2
+        elif pattern[i] == "*":
+            regex.append("[^/]*")
+            i += 1
+            while i < n and pattern[i] == "*":
+                i += 1
+        elif pattern[i] == "?":
+            regex.append("[^/]")
+            i += 1
+        elif pattern[i] == "[" and (end := pattern.find("]", i + 2)) != -1:
+            body = pattern[i + 1 : end]
+            if body[0] in "!^":
+                body = "^" + body[1:]
+            regex.append(f"[{body.replace(chr(92), chr(92) * 2)}]")
+            i = end + 1
+        elif pattern[i] == "\\" and i + 1 < n:
+            regex.append(re.escape(pattern[i + 1]))
+            i += 2
+        else:
+            regex.append(re.escape(pattern[i]))
+            i += 1
+    return "".join(regex)
+
+
+@dataclass
+class IgnorePattern:
+    """One line of a .gitignore, compiled once"""
+
+    base: str
+    regex: re.Pattern
+    negated: bool = False
+    dir_only: bool = False
+    # a pattern without a slash matches the name at any depth below `base`
+    basename_only: bool = False
+
+    @classmethod
+    def from_line(cls, line: str, base: str = "") -> "IgnorePattern | None":
+        line = line.rstrip("\n").rstrip("\r")
+        stripped = line.rstrip(" ")
+        if stripped.endswith("\\") and len(stripped) < len(line):
+            stripped += " "
+        line = stripped
+        if not line or line.startswith("#"):
+            return None
+
+        negated = line.startswith("!")
+        if negated:
+            line = line[1:]
+        elif line.startswith("\\!") or line.startswith("\\#"):
+            line = line[1:]
+        dir_only = line.endswith("/")
+        line = line.rstrip("/")
+        if not line:
+            return None
+        basename_only = "/" not in line
+        line = line.lstrip("/")
+        return IgnorePattern(
+            base=base,
+            regex=re.compile(translate(line), re.DOTALL),
+            negated=negated,
+            dir_only=dir_only,
+            basename_only=basename_only,
+        )
+
+    def matches(self, path: str, is_dir: bool) -> bool:
+        if self.dir_only and not is_dir:
+            return False
+        if self.base:
+            if not path.startswith(self.base + "/"):
+                return False
+            path = path[len(self.base) + 1 :]
+        if self.basename_only:
+            path = path.rpartition("/")[2]
+        return self.regex.fullmatch(path) is not None
+
+
+class GitIgnore:
+    """
+    Decide whether a workspace path is ignored, the way git does: patterns come from
+    .git/info/exclude and from the .gitignore of every directory above the path, a
+    deeper file or a later line wins over an earlier one, and nothing below an ignored
+    directory can be re-included. The .gitignore of a directory is read and compiled
+    once, and so is the verdict for every directory, so a walk that prunes ignored
+    directories pays one lookup per directory instead of matching all its parents.
+    """
+
+    def __init__(self, root_dir: Path):
+        self.root_dir = root_dir
+        self._patterns: dict[str, list[IgnorePattern]] = {}
+        self._dir_verdicts: dict[str, bool] = {}
+
+    def is_ignored(self, path: str, is_dir: bool = False) -> bool:
+        """`path` is relative to the root dir, with `/` separators"""
+        if is_dir:
+            return self._is_dir_ignored(path)
+        parent, _, name = path.rpartition("/")
+        if parent and self._is_dir_ignored(parent):
+            return True
+        return self._matches(path, is_dir=False)
+
+    def _is_dir_ignored(self, dir_path: str) -> bool:
+        verdict = self._dir_verdicts.get(dir_path)
+        if verdict is None:
+            parent, _, name = dir_path.rpartition("/")
+            verdict = (bool(parent) and self._is_dir_ignored(parent)) or self._matches(
+                dir_path, is_dir=True
+            )
+            self._dir_verdicts[dir_path] = verdict
+        return verdict
+
+    def _matches(self, path: str, is_dir: bool) -> bool:
+        if path.rpartition("/")[2] in IGNORE:
+            return True
+        for pattern in reversed(self.patterns(path.rpartition("/")[0])):
+            if pattern.matches(path, is_dir):
+                return not pattern.negated
+        return False
+
+    def patterns(self, dir_path: str) -> list[IgnorePattern]:
+        """Every pattern that applies to the entries of `dir_path`, lowest priority first"""
+        patterns = self._patterns.get(dir_path)
+        if patterns is None:
+            if dir_path:
+                patterns = self.patterns(dir_path.rpartition("/")[0]).copy()
+            else:
+                patterns = self._read(self.root_dir / ".git/info/exclude", "")
+            patterns.extend(self._read(self.root_dir / dir_path / IGNORE_FILE, dir_path))
+            self._patterns[dir_path] = patterns
+        return patterns
+
+    @staticmethod
+    def _read(path: Path, base: str) -> list[IgnorePattern]:
+        try:
+            lines = path.read_text().splitlines()
+        except (FileNotFoundError, NotADirectoryError, UnicodeDecodeError):
+            return []
+        return [p for p in (IgnorePattern.from_line(line, base) for line in lines) if p]
@@ -1,14 +1,43 @@
-from dataclasses import dataclass
-import re
+from collections.abc import MutableMapping
+from dataclasses import dataclass, field
+import mmap
+import struct
 from functools import cached_property
 from pathlib import Path
 import hashlib
 
+from pit.cache_tree import CacheTree
+from pit.exceptions import FileChangedWhileReading, UnsupportedIndexExtension
+from pit.fsmonitor import FSMonitorState
 from pit.git_object import Blob, TreeEntry
+from pit.path_trie import PathTrie
 from pit.values import GitFileMode, GitPath
+from pit.untracked_cache import UntrackedCache
 import os
 
 
+def encode_varint(value: int) -> bytes:
+    """git's offset varint: big-endian base-128 where each continuation adds one"""
+    encoded = [value & 0x7F]
+    value >>= 7
+    while value:
+        value -= 1
+        encoded.append(0x80 | (value & 0x7F))
+        value >>= 7
+    return bytes(reversed(encoded))
+
+
+def decode_varint(buffer, offset: int) -> (int, int):
+    byte = buffer[offset]
+    offset += 1
+    value = byte & 0x7F
+    while byte & 0x80:
+        byte = buffer[offset]
+        offset += 1
+        value = ((value + 1) << 7) | (byte & 0x7F)
+    return value, offset
+
+
 @dataclass
 class IndexHeader:
     """
@@ -61,6 +90,8 @@ class IndexEntry:
     - 160-bit (20-byte) SHA-1
     - 16-bit(2-byte) other information，其中包含了文件名的长度
         - 比如 00 08 66 69 6c 65 2e 74 ..file.txt
+        - 0x4000 为 extended flag，置位时后面再跟 16-bit 的 extended flags (version 3 起)，
+          其中 0x4000 为 skip-worktree：文件不在 sparse checkout 的范围内，工作区中没有它
     - filename
     - 最后 padding zero 使得整个 entry 的长度是 8 的倍数
     - 所有 entries 的最后 60-bit (20-byte) SHA-1 是整个 index 的 hash，防止数据丢失
@@ -79,6 +110,10 @@ class IndexEntry:
     file_hash: bytes
     file_path_length: int
     file_path: str
+    skip_worktree: bool = False
+    # not stored: the stat data was checked against the content by this process, like
+    # git's CE_UPTODATE, so the entry need not be smudged when the index is written
+    uptodate: bool = field(default=False, compare=False)
 
     @cached_property
     def oid(self) -> str:
@@ -88,7 +123,27 @@ class IndexEntry:
         return TreeEntry(oid=self.file_hash.hex(), path=self.file_path, mode=self.mode)
 
     def __bytes__(self):
-        return b"%s%s%s%s%s%s%s%s%s%s%s%s%s%s" % (
+        return b"%s%s%s" % (
+            self.stat_bytes(),
+            self.file_path.encode() + b"\x00",
+            b"\x00" * self.padding_zeros,
+        )
+
+    def to_v4_bytes(self, previous_path: str) -> bytes:
+        """
+        v4 entry: no padding, and the path is stored as the number of bytes to drop from
+        the end of the previous entry's path followed by the NUL terminated new suffix
+        """
+        path, previous = self.file_path.encode(), previous_path.encode()
+        common = len(os.path.commonprefix([path, previous]))
+        return b"%s%s%s\x00" % (
+            self.stat_bytes(),
+            encode_varint(len(previous) - common),
+            path[common:],
+        )
+
+    def stat_bytes(self) -> bytes:
+        return b"%s%s%s%s%s%s%s%s%s%s%s%s" % (
             self.ctime.to_bytes(4, "big"),
             self.ctime_ns.to_bytes(4, "big"),
             self.mtime.to_bytes(4, "big"),
@@ -100,32 +155,94 @@ class IndexEntry:
             self.gid.to_bytes(4, "big"),
             self.file_size.to_bytes(4, "big"),
             self.file_hash,
-            self.file_path_length.to_bytes(2, "big"),
-            self.file_path.encode() + b"\x00",
-            b"\x00" * self.padding_zeros,
+            self.flag_bytes(),
+        )
+
+    def flag_bytes(self) -> bytes:
+        if not self.skip_worktree:
+            return self.file_path_length.to_bytes(2, "big")
+        return b"%s%s" % (
+            (self.file_path_length | self.EXTENDED_FLAG).to_bytes(2, "big"),
+            self.SKIP_WORKTREE_FLAG.to_bytes(2, "big"),
         )
 
+    # 10 个 32-bit 的 stat 字段 + 20 bytes SHA-1 + 16-bit flags
+    STAT = struct.Struct(">10I20sH")
+    PATH_LENGTH_MASK = 0xFFF
+    EXTENDED_FLAG = 0x4000
+    SKIP_WORKTREE_FLAG = 0x4000
+
     @classmethod
     def from_raw(cls, raw: bytes):
-        file_path_length = int.from_bytes(raw[60:62], "big")
+        return cls.from_buffer(raw, 0)
+
+    @classmethod
+    def from_buffer(cls, buffer, offset: int, file_path: str = None) -> "IndexEntry":
+        """Decode the entry at `offset` straight from the (memory-mapped) index buffer"""
+        (
+            ctime, ctime_ns, mtime, mtime_ns, dev, ino, mode, uid, gid, file_size,
+            file_hash, flags,
+        ) = cls.STAT.unpack_from(buffer, offset)
+        if file_path is None:
+            file_path = cls.path_at(buffer, offset)
+        skip_worktree = False
+        if flags & cls.EXTENDED_FLAG:
+            extended_start = offset + cls.STAT.size
+            extended = int.from_bytes(buffer[extended_start : extended_start + 2], "big")
+            skip_worktree = bool(extended & cls.SKIP_WORKTREE_FLAG)
         return IndexEntry(
-            ctime=int.from_bytes(raw[:4], "big"),
-            ctime_ns=int.from_bytes(raw[4:8], "big"),
-            mtime=int.from_bytes(raw[8:12], "big"),
-            mtime_ns=int.from_bytes(raw[12:16], "big"),
-            dev=int.from_bytes(raw[16:20], "big"),
-            ino=int.from_bytes(raw[20:24], "big"),
-            mode=int.from_bytes(raw[24:28], "big"),
-            uid=int.from_bytes(raw[28:32], "big"),
-            gid=int.from_bytes(raw[32:36], "big"),
-            file_size=int.from_bytes(raw[36:40], "big"),
-            file_hash=raw[40:60],
-            file_path_length=file_path_length,
-            file_path=raw[62 : 62 + file_path_length].decode(),
+            ctime=ctime,
+            ctime_ns=ctime_ns,
+            mtime=mtime,
+            mtime_ns=mtime_ns,
+            dev=dev,
+            ino=ino,
+            mode=mode,
+            uid=uid,
+            gid=gid,
+            file_size=file_size,
+            file_hash=file_hash,
+            file_path_length=flags & cls.PATH_LENGTH_MASK,
+            file_path=file_path,
+            skip_worktree=skip_worktree,
         )
 
     @classmethod
-    def from_file(cls, file: Path) -> "IndexEntry":
+    def is_extended(cls, buffer, offset: int) -> bool:
+        """Whether the entry at `offset` carries the extra 16-bit extended flags"""
+        flags_start = offset + cls.STAT.size - 2
+        flags = int.from_bytes(buffer[flags_start : flags_start + 2], "big")
+        return bool(flags & cls.EXTENDED_FLAG)
+
+    @classmethod
+    def path_at(cls, buffer, offset: int) -> str:
+        flags_end = offset + cls.STAT.size
+        start = flags_end + (2 if cls.is_extended(buffer, offset) else 0)
+        length = int.from_bytes(buffer[flags_end - 2 : flags_end], "big") & cls.PATH_LENGTH_MASK
+        if length == cls.PATH_LENGTH_MASK:
+            # the path is too long for the flags, it ends at the first NUL
+            length = bytes(buffer[start : start + 4096 * 4]).index(b"\x00")
+        return bytes(buffer[start : start + length]).decode()
+
+    @classmethod
+    def v4_path_at(cls, buffer, offset: int, previous_path: str) -> (str, int):
+        """Path of the v4 entry at `offset` and the size of the whole entry"""
+        start = offset + cls.STAT.size + (2 if cls.is_extended(buffer, offset) else 0)
+        strip, suffix_start = decode_varint(buffer, start)
+        suffix_end = suffix_start
+        while buffer[suffix_end]:
+            suffix_end += 1
+        previous = previous_path.encode()
+        path = previous[: len(previous) - strip] + bytes(buffer[suffix_start:suffix_end])
+        return path.decode(), suffix_end + 1 - offset
+
+    @classmethod
+    def length_at(cls, path: str, extended: bool = False) -> int:
+        """On-disk size of a v2/v3 entry: NUL terminated path padded to a multiple of 8"""
+        return (cls.STAT.size + (2 if extended else 0) + len(path.encode()) + 8) // 8 * 8
+
+    @classmethod
+    def from_file(cls, file: Path, oid: str = None) -> "IndexEntry":
         """
         os.stat_result(
             st_mode=33261,
@@ -139,106 +256,320 @@ class IndexEntry:
             st_mtime=1635484837,
             st_ctime=1635484871)
         :param file:
+        :param oid: blob oid of the file when the caller already knows it, so the file
+            is not read and hashed again; the stat data is then taken now, callers that
+            hashed the file themselves should use `from_stat` with the stat from then
         :return:
         """
         # TODO: when file_path is longer than 4096 bytes,
         # the max value of the file_path_length should be set to 4096 bytes
         # when restoring the overflowed file_path, we should use incremental scanning
-        blob = Blob(file.read_bytes())
-        file_hash = bytes.fromhex(blob.oid)
-        file_stat = file.stat()
+        if oid is None:
+            oid, file_stat = Blob.hash_file(file)
+        else:
+            file_stat = file.stat()
+        return cls.from_stat(file, oid, file_stat)
+
+    @classmethod
+    def from_stat(cls, file: Path | str, oid: str, file_stat: os.stat_result) -> "IndexEntry":
+        """Entry for a file whose blob oid and stat data are already known"""
+        return IndexEntry(
+            **cls.stat_fields(file_stat),
+            file_hash=bytes.fromhex(oid),
+            file_path_length=min(len(str(file).encode()), cls.PATH_LENGTH_MASK),
+            file_path=str(file),
+            uptodate=True,
+        )
+
+    @classmethod
+    def skipped(cls, file: str, oid: str, mode: int) -> "IndexEntry":
+        """Entry for a file outside the sparse checkout: no stat data, never in the workspace"""
         return IndexEntry(
-            ctime=int(file_stat.st_ctime),
-            ctime_ns=int(file_stat.st_ctime_ns - int(file_stat.st_ctime) * 10 ** 9),
-            mtime=int(file_stat.st_mtime),
-            mtime_ns=int(file_stat.st_mtime_ns - int(file_stat.st_mtime) * 10 ** 9),
+            ctime=0, ctime_ns=0, mtime=0, mtime_ns=0, dev=0, ino=0, mode=mode, uid=0, gid=0,
+            file_size=0,
+            file_hash=bytes.fromhex(oid),
+            file_path_length=min(len(file.encode()), cls.PATH_LENGTH_MASK),
+            file_path=file,
+            skip_worktree=True,
+        )
+
+    @staticmethod
+    def stat_fields(file_stat: os.stat_result) -> dict[str, int]:
+        ctime, ctime_ns = divmod(file_stat.st_ctime_ns, 10**9)
+        mtime, mtime_ns = divmod(file_stat.st_mtime_ns, 10**9)
+        return dict(
+            ctime=ctime,
+            ctime_ns=ctime_ns,
+            mtime=mtime,
+            mtime_ns=mtime_ns,
             dev=file_stat.st_dev,
             ino=int.from_bytes(file_stat.st_ino.to_bytes(8, "big")[-4:], "big"),
             mode=file_stat.st_mode,
             uid=file_stat.st_uid,
             gid=file_stat.st_gid,
             file_size=file_stat.st_size,
-            file_hash=file_hash,
-            file_path_length=len(str(file)),
-            file_path=str(file),
         )
 
+    def matches_stat(self, file_stat: os.stat_result) -> bool:
+        """Whether the cached stat data still describes the file, compared as stored on disk"""
+        fields = self.stat_fields(file_stat)
+        return (
+            self.mtime == fields["mtime"]
+            and self.mtime_ns == fields["mtime_ns"]
+            and self.ctime == fields["ctime"]
+            and self.ctime_ns == fields["ctime_ns"]
+            and self.ino == fields["ino"]
+            and (self.dev ^ fields["dev"]) & 0xFFFFFFFF == 0
+            and self.uid == fields["uid"]
+            and self.gid == fields["gid"]
+            and (self.file_size ^ fields["file_size"]) & 0xFFFFFFFF == 0
+            and GitFileMode(self.mode) == GitFileMode(fields["mode"])
+        )
+
+    @property
+    def mtime_total_ns(self) -> int:
+        return self.mtime * 10**9 + self.mtime_ns
+
     @property
     def padding_zeros(self):
         # + 1 because file_path ends with '\x00'
-        entry_length = 62 + self.file_path_length + 1
+        flags_length = 4 if self.skip_worktree else 2
+        entry_length = 60 + flags_length + len(self.file_path.encode()) + 1
         return 8 - entry_length % 8 if entry_length % 8 else 0
 
     @property
     def length(self):
-        return len(bytes(self))
+        return self.length_at(self.file_path, self.skip_worktree)
+
+
+class IndexEntries(MutableMapping):
+    """
+    file path -> IndexEntry, where entries read from disk stay as offsets into the
+    memory-mapped index until they are first accessed. Only the paths are decoded when
+    the index is loaded; a command that looks at a few paths never unpacks the rest.
+    """
+
+    def __init__(self, buffer=None):
+        self._buffer = buffer
+        self._entries: dict[str, IndexEntry | int] = {}
+
+    def add_lazy(self, path: str, offset: int):
+        self._entries[path] = offset
+
+    def __getitem__(self, path: str) -> IndexEntry:
+        entry = self._entries[path]
+        if isinstance(entry, int):
+            entry = IndexEntry.from_buffer(self._buffer, entry, path)
+            self._entries[path] = entry
+        return entry
+
+    def __setitem__(self, path: str, entry: IndexEntry):
+        self._entries[path] = entry
+
+    def __delitem__(self, path: str):
+        del self._entries[path]
+
+    def __contains__(self, path) -> bool:
+        return path in self._entries
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return f"<IndexEntries({len(self)} entries)>"
 
 
 class Index:
-    entries: dict[str, IndexEntry]
+    entries: IndexEntries
     header: IndexHeader
 
-    def __init__(self, root_dir: Path):
+    SUPPORTED_VERSIONS = (2, 3, 4)
+
+    def __init__(self, root_dir: Path, version: int = None):
+        """
+        :param version: format to write the index in (index.version); 4 prefix-compresses
+            each path against the previous one. Defaults to the version read from disk.
+        """
         self._root_dir = root_dir
         self._git_dir = self._root_dir / ".git"
         self.index_path = self._git_dir / "index"
-        self.header, self.entries = self._parse()
+        # taken before reading, a rewrite in between then only makes the index look stale
+        self._disk_stat = self._stat_key()
+        (
+            self.header,
+            self.entries,
+            self.cache_tree,
+            self.untracked_cache,
+            self.fsmonitor,
+        ) = self._parse()
+        # paths the fsmonitor daemon reported since `self.fsmonitor.token`, None if unknown
+        self.fsmonitor_changes: set[str] | None = None
+        if version in self.SUPPORTED_VERSIONS:
+            self.header.version = version
+        self.mtime_ns = self._disk_stat[2] if self._disk_stat else 0
 
     def __repr__(self):
         return f"<Index(header={self.header}, entries={self.entries})>"
 
+    def _stat_key(self) -> tuple[int, int, int] | None:
+        try:
+            file_stat = self.index_path.stat()
+        except FileNotFoundError:
+            return None
+        return file_stat.st_ino, file_stat.st_size, file_stat.st_mtime_ns
+
+    def is_stale(self) -> bool:
+        """Whether the index file was rewritten since this copy of it was read"""
+        return self._stat_key() != self._disk_stat
+
     def __bytes__(self):
         self.header.entries = len(self.entries)
-        data = b"%s%s" % (
-            self.header,
-            b"".join(
-                [
-                    bytes(e)
-                    for e in sorted(self.entries.values(), key=lambda e: e.file_path)
-                ]
-            ),
-        )
+        entries = sorted(self.entries.values(), key=lambda e: e.file_path)
+        if self.header.version < 4:
+            # extended flags need version 3, without them git writes version 2
+            self.header.version = 3 if any(e.skip_worktree for e in entries) else 2
+        if self.header.version >= 4:
+            previous_paths = [""] + [e.file_path for e in entries[:-1]]
+            raw_entries = [e.to_v4_bytes(p) for e, p in zip(entries, previous_paths)]
+        else:
+            raw_entries = [bytes(e) for e in entries]
+        data = b"%s%s" % (self.header, b"".join(raw_entries))
+        if self.cache_tree.valid or self.cache_tree.children:
+            cache_tree = bytes(self.cache_tree)
+            data += b"%s%s%s" % (
+                CacheTree.SIGNATURE,
+                len(cache_tree).to_bytes(4, "big"),
+                cache_tree,
+            )
+        if self.untracked_cache is not None:
+            untracked_cache = bytes(self.untracked_cache)
+            data += b"%s%s%s" % (
+                UntrackedCache.SIGNATURE,
+                len(untracked_cache).to_bytes(4, "big"),
+                untracked_cache,
+            )
+        if self.fsmonitor is not None:
+            fsmonitor = bytes(self.fsmonitor)
+            data += b"%s%s%s" % (
+                FSMonitorState.SIGNATURE,
+                len(fsmonitor).to_bytes(4, "big"),
+                fsmonitor,
+            )
 
         return b"%s%s" % (
             data,
             hashlib.sha1(data).digest(),
         )
 
-    def has_tracked(self, path: Path) -> bool:
-        path = str(Path(path).resolve().relative_to(self._root_dir.resolve()))
+    @cached_property
+    def tracked_paths(self) -> PathTrie:
+        """Built on first use, then kept up to date by every change to the entries"""
+        return PathTrie(self.entries)
+
+    def has_tracked(self, path: Path | str) -> bool:
+        """Whether `path` is a tracked file or a directory containing one"""
+        path = GitPath(path, self._root_dir).path.as_posix()
         if path in self.entries:
             return True
-        if path in self.parents:
-            return True
-        return False
+        return (path if path != "." else "") in self.tracked_paths
 
     def has_modified(self, path: Path) -> bool:
-        return IndexEntry.from_file(path) != self.entries.get(
-            str(GitPath(path, root_dir=self._root_dir))
+        """
+        Trust the cached stat data when it still matches the file, and only read and hash
+        the file when it does not. An entry whose mtime is not older than the index file
+        itself is racily clean: the file may have been changed again within the same
+        timestamp tick after it was added, so it is always hashed.
+        """
+        entry_path = str(GitPath(path, root_dir=self._root_dir))
+        entry = self.entries.get(entry_path)
+        if entry is None:
+            return True
+        if self.is_fsmonitor_clean(entry_path):
+            return False
+        file_stat = os.lstat(path)
+        if entry.matches_stat(file_stat) and not self.is_racy(entry):
+            return False
+        modified = GitFileMode(entry.mode) != GitFileMode(file_stat.st_mode) or (
+            entry.oid != Blob.hash_file(path)[0]
         )
+        entry.uptodate = not modified and entry.matches_stat(file_stat)
+        if modified and self.is_racy(entry):
+            # smudge the size as git does, the stat data must not look clean once a
+            # rewritten index is newer than the file
+            entry.file_size = 0
+        return modified
+
+    def is_fsmonitor_clean(self, path: str) -> bool:
+        """
+        Whether the fsmonitor daemon vouches that a tracked path is unchanged: it was
+        clean at the last token and nothing at or above it was reported since.
+        """
+        if self.fsmonitor is None or self.fsmonitor_changes is None:
+            return False
+        if path in self.fsmonitor.dirty:
+            return False
+        while path:
+            if path in self.fsmonitor_changes:
+                return False
+            path = path.rpartition("/")[0]
+        return True
+
+    def is_racy(self, entry: IndexEntry) -> bool:
+        """
+        Whether the entry's mtime falls in the same second as the index file or later.
+        Seconds, not nanoseconds, like git's is_racy_timestamp: a git built without
+        USE_NSEC compares whole seconds, and trusts stat data from the same second.
+        """
+        return entry.mtime >= self.mtime_ns // 10**9
 
-    @property
-    def parents(self):
-        parents = set()
-        for path in self.entries:
-            for p in Path(path).parents:
-                parents.add(str(p))
-        return parents
-
-    def add_file(self, file_path: Path | str):
+    def smudge_racy_entries(self):
+        """
+        Called before the index is written, like git's ce_smudge_racily_clean_entry. An
+        entry not older than the index it was read from may hide a same-size change made
+        within the same timestamp tick, and once the rewritten index is newer than the
+        file `is_racy` no longer catches it. Every such entry whose content no longer
+        matches the file gets its size zeroed, so that it never matches the stat data
+        again. That includes entries whose nanoseconds differ from the file's, which a
+        reader comparing whole seconds would still take for clean. Entries this process
+        already checked are left alone.
+        """
+        if not self.mtime_ns:
+            return
+        for entry in self.entries.values():
+            if entry.uptodate or entry.skip_worktree or not self.is_racy(entry):
+                continue
+            path = self._root_dir / entry.file_path
+            try:
+                if entry.oid != Blob.hash_file(path)[0]:
+                    entry.file_size = 0
+            except OSError:
+                # gone or no longer a file: the stat data cannot look clean anyway
+                continue
+            except FileChangedWhileReading:
+                entry.file_size = 0
+
+    def add_file(self, file_path: Path | str, oid: str = None):
         # if sub path try to format the sub path to the path relative to the root dir
         file_path = Path(file_path).resolve().relative_to(self._root_dir.resolve())
-        for parent_dir in file_path.parents:
-            self.entries.pop(str(parent_dir), None)
-
-        new_entry = IndexEntry.from_file(file_path)
-        self.entries[new_entry.file_path] = new_entry
+        self.add_entry(IndexEntry.from_file(file_path, oid))
+
+    def add_entry(self, entry: IndexEntry):
+        """`entry.file_path` must already be relative to the root dir"""
+        for parent_dir in Path(entry.file_path).parents:
+            if self.entries.pop(str(parent_dir), None) is not None:
+                self._invalidate(str(parent_dir), removed=True)
+        self.entries[entry.file_path] = entry
+        self._invalidate(entry.file_path)
         self.header.entries = len(self.entries)
 
     def remove_file(self, file_path: Path | str):
         # if sub path try to format the sub path to the path relative to the root dir
         git_path = GitPath(file_path, self._root_dir)
-        self.entries.pop(str(git_path), None)
+        if self.entries.pop(str(git_path), None) is not None:
+            self._invalidate(str(git_path), removed=True)
         self.header.entries = len(self.entries)
 
     def clean(self):
@@ -246,23 +577,142 @@ class Index:
         for entry_file_path in list(self.entries):
             if not os.path.exists(entry_file_path):
                 self.entries.pop(entry_file_path)
+                self._invalidate(entry_file_path, removed=True)
         self.header.entries = len(self.entries)
 
+    def _invalidate(self, path: str, removed: bool = False):
+        if "tracked_paths" in self.__dict__:
+            if removed:
+                self.tracked_paths.remove(path)
+            else:
+                self.tracked_paths.add(path)
+        self.cache_tree.invalidate(path)
+        if self.untracked_cache is not None:
+            self.untracked_cache.invalidate(path)
+        if self.fsmonitor is not None:
+            self.fsmonitor.dirty.add(path)
+
     def _parse(self):
-        raw = self.index_path.read_bytes() if self.index_path.exists() else b""
-        header = IndexHeader.from_raw(raw)
-        entries = {}
+        if not self.index_path.exists() or not self.index_path.stat().st_size:
+            return IndexHeader.from_raw(b""), IndexEntries(), CacheTree(), None, None
+
+        with open(self.index_path, "rb") as f:
+            # the mapping outlives the file object and any later rename over the index
+            buffer = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        header = IndexHeader.from_raw(buffer[:12].tobytes())
+        entries = IndexEntries(buffer)
         scanned = 12
+        path = ""
         for _ in range(header.entries):
-            entry = IndexEntry.from_raw(raw[scanned:])
-            entries[entry.file_path] = entry
-            scanned += entry.length
+            if header.version >= 4:
+                path, length = IndexEntry.v4_path_at(buffer, scanned, path)
+            else:
+                path = IndexEntry.path_at(buffer, scanned)
+                length = IndexEntry.length_at(path, IndexEntry.is_extended(buffer, scanned))
+            entries.add_lazy(path, scanned)
+            scanned += length
+
+        extensions = self._parse_extensions(buffer, scanned)
+        cache_tree = (
+            CacheTree.from_raw(extensions[CacheTree.SIGNATURE])
+            if CacheTree.SIGNATURE in extensions
+            else CacheTree()
+        )
+        untracked_cache = (
+            UntrackedCache.from_raw(extensions[UntrackedCache.SIGNATURE])
+            if UntrackedCache.SIGNATURE in extensions
+            else None
+        )
+        fsmonitor = (
+            FSMonitorState.from_raw(extensions[FSMonitorState.SIGNATURE])
+            if FSMonitorState.SIGNATURE in extensions
+            else None
+        )
+        return header, entries, cache_tree, untracked_cache, fsmonitor
 
-        return header, entries
+    @staticmethod
+    def _parse_extensions(buffer, offset: int) -> dict[bytes, memoryview]:
+        """
+        Extensions sit between the last entry and the trailing checksum, each one as a
+        4 bytes signature, a 32-bit size and the data. Unknown ones are dropped only when
+        their signature starts with an upper case letter, git's mark of an optional
+        extension. Any other one, e.g. `link` of a split index or `sdir` of a sparse
+        index, changes what the entries mean, so reading on without it would be wrong.
+        """
+        extensions = {}
+        end = len(buffer) - 20
+        while offset + 8 <= end:
+            signature = buffer[offset : offset + 4].tobytes()
+            if not b"A" <= signature[:1] <= b"Z":
+                raise UnsupportedIndexExtension(signature.decode(errors="replace"))
+            size = int.from_bytes(buffer[offset + 4 : offset + 8], "big")
+            extensions[signature] = buffer[offset + 8 : offset + 8 + size]
+            offset += 8 + size
+        return extensions
 
 
 if __name__ == "__main__":
-    index = Index("/Users/apple/works/projects/learn/learn_pit/ex2_nested")
-    print(index)
-    hex_index = (b"%s" % index).hex()
-    print(re.findall("\w{4}", hex_index))
+    import tempfile
+
+    print("Test index v4 write/read round trip")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        root_dir = Path(tmp_dir)
+        (root_dir / ".git").mkdir()
+        os.chdir(root_dir)
+        paths = ["a.txt", "dir/a.txt", "dir/ab.txt", "dir/sub/deep.txt", "dirs.txt", "z"]
+        for path in paths:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            Path(path).write_text(path)
+        index = Index(root_dir)
+        for path in paths:
+            index.add_entry(IndexEntry.from_file(Path(path)))
+        index.add_entry(IndexEntry.skipped("dir/skipped.txt", "0" * 40, 0o100644))
+        v3_raw = bytes(index)
+
+        index.header.version = 4
+        v4_raw = bytes(index)
+        assert len(v4_raw) < len(v3_raw)
+        index.index_path.write_bytes(v4_raw)
+        reread = Index(root_dir)
+        assert reread.header.version == 4
+        assert dict(reread.entries) == dict(index.entries)
+        assert bytes(reread) == v4_raw
+
+        # index.version=3 on the way back gives the extended-flags format again
+        assert bytes(Index(root_dir, version=3)) == v3_raw
+
+    print("Test racy entries are smudged at whole second granularity")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        root_dir = Path(tmp_dir)
+        (root_dir / ".git").mkdir()
+        os.chdir(root_dir)
+        second = 1_700_000_000 * 10**9
+        Path("f").write_text("aaaa")
+        os.utime("f", ns=(second + 100, second + 100))
+        index = Index(root_dir)
+        index.add_entry(IndexEntry.from_file(Path("f")))
+        index.index_path.write_bytes(bytes(index))
+        # the index is written later within the same second, then f changes size-preserving
+        os.utime(index.index_path, ns=(second + 500, second + 500))
+        Path("f").write_text("cccc")
+        os.utime("f", ns=(second + 900, second + 900))
+
+        reread = Index(root_dir)
+        assert reread.is_racy(reread.entries["f"])
+        reread.smudge_racy_entries()
+        assert reread.entries["f"].file_size == 0
+
+    print("Test unknown extensions: optional ones are dropped, mandatory ones refused")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        root_dir = Path(tmp_dir)
+        (root_dir / ".git").mkdir()
+        data = bytes(Index(root_dir))[:-20]
+        for signature, readable in ((b"ZOPT", True), (b"link", False)):
+            raw = data + signature + (4).to_bytes(4, "big") + b"\x00" * 4
+            (root_dir / ".git/index").write_bytes(raw + hashlib.sha1(raw).digest())
+            try:
+                Index(root_dir)
+                assert readable, signature
+            except UnsupportedIndexExtension:
+                assert not readable, signature
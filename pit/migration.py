@@ -1,77 +1,256 @@
 import os
+import posixpath
+import shutil
 from pathlib import Path
 
 from pit.exceptions import CheckoutConflict
-from pit.git_object import TreeEntry
+from pit.git_object import CHUNK_SIZE, TreeEntry
+from pit.config import Config
 from pit.index import IndexEntry
+from pit.process_pool import run_batches, worker_database
 from pit.repository import Repository
+from pit.sparse_checkout import SparseCheckout
 from pit.tree_diff import TreeDiff, Added, Deleted, Updated
+from pit.values import GitFileMode
+
+
+def checkout_files(
+    root_dir: str, writes: list[(str, str, int)]
+) -> list[(str, str, os.stat_result)]:
+    """Write (path, blob oid, mode) to the workspace, streaming each blob"""
+    database = worker_database(root_dir)
+    written = []
+    for path, oid, mode in writes:
+        file_path = os.path.join(root_dir, path)
+        # stream the blob so that large binaries are never held in memory as a whole
+        with database.open_stream(oid) as stream, open(file_path, "wb") as f:
+            shutil.copyfileobj(stream, f, CHUNK_SIZE)
+        os.chmod(file_path, mode)
+        written.append((path, oid, os.stat(file_path)))
+    return written
 
 
 class Migration:
-    def __init__(self, repo: Repository):
+    def __init__(self, repo: Repository, *, config: Config = None):
+        """:param config: where to read checkout.workers from, defaults to the repo's"""
         self.repo = repo
+        config = config or repo.config
+        self.workers = config.get_int("checkout.workers", os.cpu_count() or 1)
 
     def apply(self, tree_diff: dict[str, Added | Deleted | Updated]):
-        conflicts = []
-        added = {}
-        deleted = {}
-        updated = {}
-        for path, diff in tree_diff.items():
-            path = Path(path)
-            match diff:
-                case Added():
-                    if path.exists():
-                        conflicts.append(str(path))
-                    else:
-                        added[path] = diff
-                case Deleted():
-                    if self._detect_deleted_conflict(path, diff):
-                        conflicts.append(str(path))
-                    else:
-                        deleted[path] = diff
-                case Updated():
-                    if self._detect_updated_conflict(path, diff):
-                        conflicts.append(str(path))
-                    else:
-                        updated[path] = diff
-                case _:
-                    pass
-        if conflicts:
-            raise CheckoutConflict(conflicts)
-
-        # delete first
-        for path, diff in deleted.items():
-            path.unlink(missing_ok=True)
-            self.repo.index.remove_file(path)
-            if not any(os.scandir(path.parent)):
-                path.parent.rmdir()
-
-        for path, diff in added.items():
-            path.parent.mkdir(parents=True, exist_ok=True)
-            path.write_bytes(self.repo.database.load(diff.entry.oid).content)
-            self.repo.index.add_file(path)
-        for path, diff in updated.items():
-            path.write_bytes(self.repo.database.load(diff.after.oid).content)
-            path.chmod(diff.after.mode)
-            self.repo.index.add_file(path)
-
-        self.repo.database.store_index(self.repo.index)
+        # the lock is taken before anything is checked or written, so a held lock
+        # leaves the workspace untouched
+        with self.repo.database.lock_index():
+            sparse = self.repo.sparse_checkout
+            conflicts = []
+            added = {}
+            deleted = {}
+            updated = {}
+            skipped = {}
+            for path, diff in tree_diff.items():
+                path = Path(path)
+                if sparse is not None and not sparse.includes(path.as_posix()):
+                    skipped[path] = diff
+                    continue
+                match diff:
+                    case Added():
+                        if path.exists() and not self._is_replaced_dir(path, tree_diff):
+                            conflicts.append(str(path))
+                        else:
+                            added[path] = diff
+                    case Deleted():
+                        if self._detect_deleted_conflict(path, diff):
+                            conflicts.append(str(path))
+                        else:
+                            deleted[path] = diff
+                    case Updated():
+                        if self._detect_updated_conflict(path, diff):
+                            conflicts.append(str(path))
+                        else:
+                            updated[path] = diff
+                    case _:
+                        pass
+            if conflicts:
+                raise CheckoutConflict(conflicts)
+
+            # outside the sparse checkout only the index changes, the files are never there
+            for path, diff in skipped.items():
+                match diff:
+                    case Deleted():
+                        self.repo.index.remove_file(path)
+                    case Added(entry=entry) | Updated(after=entry):
+                        self.repo.index.add_entry(
+                            IndexEntry.skipped(path.as_posix(), entry.oid, entry.mode)
+                        )
+
+            # delete first, then drop the directories this left empty
+            for path in deleted:
+                path.unlink(missing_ok=True)
+                self.repo.index.remove_file(path)
+            self._remove_empty_dirs({path.parent for path in deleted})
+
+            writes = [(p.as_posix(), d.entry.oid, d.entry.mode) for p, d in added.items()]
+            writes += [(p.as_posix(), d.after.oid, d.after.mode) for p, d in updated.items()]
+            for path, oid, file_stat in self._write_files(writes):
+                self.repo.index.add_entry(IndexEntry.from_stat(path, oid, file_stat))
+
+            self.repo.database.store_index(self.repo.index)
+
+    def populate(self, entries: list[TreeEntry]):
+        """
+        Write every file of a tree into an empty workspace. Nothing can be in the way,
+        so no path is checked: the files are written as by `apply` and the index built
+        from scratch from the known oids and the stat results, then written once.
+        """
+        with self.repo.database.lock_index():
+            sparse = self.repo.sparse_checkout
+            writes = []
+            for entry in entries:
+                if sparse is None or sparse.includes(entry.path):
+                    writes.append((entry.path, entry.oid, entry.mode))
+                else:
+                    self.repo.index.entries[entry.path] = IndexEntry.skipped(
+                        entry.path, entry.oid, entry.mode
+                    )
+            for path, oid, file_stat in self._write_files(writes):
+                self.repo.index.entries[path] = IndexEntry.from_stat(path, oid, file_stat)
+            self.repo.database.store_index(self.repo.index)
+
+    def update_sparse(self, sparse: SparseCheckout | None) -> list[str]:
+        """
+        Bring the workspace in line with a new sparse checkout, or with none at all.
+        Files leaving the cone are removed and marked skip-worktree, files entering it
+        are written from the index. A file with local changes is left where it is, and
+        the paths of those are returned.
+        """
+        with self.repo.database.lock_index():
+            kept, removed, writes = [], [], []
+            for path in list(self.repo.index.entries):
+                entry = self.repo.index.entries[path]
+                included = sparse is None or sparse.includes(path)
+                if entry.skip_worktree and included:
+                    writes.append((path, entry.oid, entry.mode))
+                elif not entry.skip_worktree and not included:
+                    file_path = Path(path)
+                    if file_path.exists() and self.repo.index.has_modified(file_path):
+                        kept.append(path)
+                        continue
+                    file_path.unlink(missing_ok=True)
+                    removed.append(file_path)
+                    self.repo.index.entries[path] = IndexEntry.skipped(
+                        path, entry.oid, entry.mode
+                    )
+            self._remove_empty_dirs({path.parent for path in removed})
+            for path, oid, file_stat in self._write_files(writes):
+                self.repo.index.entries[path] = IndexEntry.from_stat(path, oid, file_stat)
+            self.repo.database.store_index(self.repo.index)
+            return kept
+
+    def _write_files(self, writes: list[(str, str, int)]) -> list[(str, str, os.stat_result)]:
+        """
+        Inflate and write the blobs, one directory per task on up to checkout.workers
+        processes, like git's parallel checkout, see `run_batches`.
+        """
+        writes = sorted(writes, key=lambda write: posixpath.dirname(write[0]))
+        # every directory is created once up front, the writers only create files
+        for dir_path in sorted({posixpath.dirname(path) for path, _, _ in writes}):
+            (self.repo.root_dir / dir_path).mkdir(parents=True, exist_ok=True)
+        return run_batches(
+            checkout_files,
+            (str(self.repo.root_dir.absolute()),),
+            writes,
+            workers=self.workers,
+            key=lambda write: posixpath.dirname(write[0]),
+        )
+
+    @staticmethod
+    def _remove_empty_dirs(dir_paths: set[Path]):
+        # deepest first, so that a directory holding only emptied ones goes as well
+        for dir_path in sorted(dir_paths, key=lambda p: len(p.parts), reverse=True):
+            while (
+                dir_path != Path(".")
+                and dir_path.is_dir()
+                and not any(os.scandir(dir_path))
+            ):
+                dir_path.rmdir()
+                dir_path = dir_path.parent
+
+    @staticmethod
+    def _is_replaced_dir(path: Path, tree_diff: dict[str, Added | Deleted | Updated]):
+        """A directory turning into a file, holding nothing but files deleted with it"""
+        if path.is_symlink() or not path.is_dir():
+            return False
+        for current, _, file_names in os.walk(path):
+            for name in file_names:
+                file_path = Path(current, name).as_posix()
+                if not isinstance(tree_diff.get(file_path), Deleted):
+                    return False
+        return True
+
+    def _is_unchanged(self, path: Path, entry: TreeEntry) -> bool:
+        """
+        Whether the workspace file still holds `entry`. When the index entry records the
+        same blob, its cached stat data decides and the file is only hashed if the stat
+        data no longer matches.
+        """
+        index_entry = self.repo.index.entries.get(path.as_posix())
+        if (
+            index_entry is not None
+            and index_entry.oid == entry.oid
+            and GitFileMode(index_entry.mode) == GitFileMode(entry.mode)
+        ):
+            return not self.repo.index.has_modified(path)
+        current = IndexEntry.from_file(path).to_tree_entry()
+        return current.mode == entry.mode and current.oid == entry.oid
 
     def _detect_deleted_conflict(self, path: Path, deleted: Deleted):
         if not path.exists():
             return True
-        current = IndexEntry.from_file(path).to_tree_entry()
-        if (current.mode != deleted.entry.mode
-                or current.oid != deleted.entry.oid
-        ):
-            return True
-        return False
+        return not self._is_unchanged(path, deleted.entry)
 
     def _detect_updated_conflict(self, path: Path, updated: Updated):
         if not path.exists():
             return True
-        current = IndexEntry.from_file(path).to_tree_entry()
-        if current.mode != updated.before.mode or current.oid != updated.before.oid:
-            return True
-        return False
+        return not self._is_unchanged(path, updated.before)
+
+
+if __name__ == "__main__":
+    import tempfile
+
+    from pit.commands.add import AddCommand
+    from pit.commands.checkout import CheckoutCommand
+    from pit.commands.commit import CommitCommand
+    from pit.commands.init import InitCommand
+
+    print("Test a held index.lock leaves the workspace untouched")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.chdir(tmp_dir)
+        InitCommand(tmp_dir).run()
+
+        def commit(message: str, path: str):
+            AddCommand(tmp_dir, paths=[path], jobs=1).run()
+            CommitCommand(
+                tmp_dir, author_name="pit", author_email="pit@example.com", commit_msg=message
+            ).run()
+
+        Path("x").write_text("file\n")
+        commit("one", "x")
+        one = Repository(tmp_dir).refs.read_head()
+        Path("x").unlink()
+        Path("x").mkdir()
+        Path("x/y").write_text("dir\n")
+        commit("two", "x")
+        two = Repository(tmp_dir).refs.read_head()
+        index_before = Path(".git/index").read_bytes()
+
+        Path(".git/index.lock").touch()
+        CheckoutCommand(tmp_dir, revision=one).run()
+        assert Path("x/y").read_text() == "dir\n"
+        assert Path(".git/index").read_bytes() == index_before
+        assert Repository(tmp_dir).refs.read_head() == two
+        assert Path(".git/index.lock").exists(), "the lock of another process is not ours"
+
+        Path(".git/index.lock").unlink()
+        CheckoutCommand(tmp_dir, revision=one).run()
+        assert Path("x").read_text() == "file\n"
+        assert not Path(".git/index.lock").exists()
@@ -0,0 +1,538 @@
+import hashlib
+import itertools
+import mmap
+import os
+import zlib
+from collections import deque
+from dataclasses import dataclass
+from pathlib import Path
+
+from pit.cache import LRUCache
+from pit.delta import DeltaIndex, apply_delta, create_delta, read_delta_size
+from pit.stream import ObjectStream, inflate_chunks
+
+OBJ_COMMIT = 1
+OBJ_TREE = 2
+OBJ_BLOB = 3
+OBJ_TAG = 4
+OBJ_OFS_DELTA = 6
+OBJ_REF_DELTA = 7
+
+TYPE_NAMES = {OBJ_COMMIT: "commit", OBJ_TREE: "tree", OBJ_BLOB: "blob", OBJ_TAG: "tag"}
+TYPE_CODES = {name: code for code, name in TYPE_NAMES.items()}
+
+PACK_SIGNATURE = b"PACK"
+IDX_SIGNATURE = b"\xfftOc"
+
+INFLATE_CHUNK = 64 * 1024
+# same defaults as git's core.deltaBaseCacheLimit and pack.depth
+DELTA_BASE_CACHE_LIMIT = 96 * 1024 * 1024
+MAX_DELTA_DEPTH = 50
+
+
+class PackIndex:
+    """
+    v2 .idx 文件
+        - 4 bytes magic \\377tOc + 4 bytes version(2)
+        - 256 个 4 bytes 的 fanout，fanout[i] 为首字节 <= i 的对象数量
+        - N 个 20 bytes 的 sha1，升序排列
+        - N 个 4 bytes 的 crc32
+        - N 个 4 bytes 的 offset，最高位为 1 时表示指向 large offset 表
+        - M 个 8 bytes 的 large offset
+        - pack checksum + idx checksum
+    """
+
+    FANOUT_START = 8
+    SHA_START = FANOUT_START + 256 * 4
+
+    def __init__(self, path: Path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:4] != IDX_SIGNATURE or self._int(4) != 2:
+            raise ValueError(f"unsupported pack index: {path}")
+        self.count = self._fanout(255)
+        self._crc_start = self.SHA_START + 20 * self.count
+        self._offset_start = self._crc_start + 4 * self.count
+        self._large_offset_start = self._offset_start + 4 * self.count
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self._sha(i).hex()
+
+    def _int(self, pos: int, size: int = 4) -> int:
+        return int.from_bytes(self._map[pos : pos + size], "big")
+
+    def _fanout(self, byte: int) -> int:
+        return self._int(self.FANOUT_START + 4 * byte)
+
+    def _sha(self, i: int) -> bytes:
+        start = self.SHA_START + 20 * i
+        return self._map[start : start + 20]
+
+    def _bounds(self, first_byte: int) -> (int, int):
+        return (self._fanout(first_byte - 1) if first_byte else 0), self._fanout(first_byte)
+
+    def _bisect(self, sha: bytes, low: int, high: int) -> int:
+        while low < high:
+            mid = (low + high) // 2
+            if self._sha(mid) < sha:
+                low = mid + 1
+            else:
+                high = mid
+        return low
+
+    def offset(self, i: int) -> int:
+        offset = self._int(self._offset_start + 4 * i)
+        if offset & 0x80000000:
+            offset = self._int(self._large_offset_start + 8 * (offset & 0x7FFFFFFF), 8)
+        return offset
+
+    def find(self, oid: str) -> int | None:
+        """Return the pack offset of `oid`, or None when this pack does not contain it"""
+        sha = bytes.fromhex(oid)
+        low, high = self._bounds(sha[0])
+        i = self._bisect(sha, low, high)
+        if i < high and self._sha(i) == sha:
+            return self.offset(i)
+        return None
+
+    def prefix_match(self, prefix_oid: str) -> list[str]:
+        prefix = bytes.fromhex(prefix_oid[: len(prefix_oid) // 2 * 2])
+        low, high = self._bounds(prefix[0]) if prefix else (0, self.count)
+        i = self._bisect(prefix, low, high)
+        matched = []
+        while i < high and self._sha(i).startswith(prefix):
+            oid = self._sha(i).hex()
+            if oid.startswith(prefix_oid):
+                matched.append(oid)
+            i += 1
+        return matched
+
+    def close(self):
+        self._map.close()
+
+
+class PackFile:
+    """
+    .pack 文件
+        - 4 bytes PACK + 4 bytes version + 4 bytes 对象数量
+        - 每个对象:
+            - 变长头部: 首字节 bit 4-6 为类型，低 4 位及后续每字节低 7 位为 inflate 后的大小
+            - OFS_DELTA 接一个负向偏移，REF_DELTA 接 20 bytes 的 base sha1
+            - zlib 压缩的数据
+        - 20 bytes checksum
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self._map)
+        if self._map[:4] != PACK_SIGNATURE:
+            raise ValueError(f"not a pack file: {path}")
+
+    def entry_header(self, offset: int) -> (int, int, int | str | None, int):
+        """
+        Parse the entry at `offset` into (type, size, base, data_offset), where base is
+        the absolute offset of an OFS_DELTA base or the oid of a REF_DELTA base.
+        """
+        start = offset
+        byte = self._map[offset]
+        offset += 1
+        type_ = (byte >> 4) & 0x7
+        size = byte & 0x0F
+        shift = 4
+        while byte & 0x80:
+            byte = self._map[offset]
+            offset += 1
+            size |= (byte & 0x7F) << shift
+            shift += 7
+
+        base = None
+        if type_ == OBJ_OFS_DELTA:
+            byte = self._map[offset]
+            offset += 1
+            distance = byte & 0x7F
+            while byte & 0x80:
+                byte = self._map[offset]
+                offset += 1
+                distance = ((distance + 1) << 7) | (byte & 0x7F)
+            base = start - distance
+        elif type_ == OBJ_REF_DELTA:
+            base = self._map[offset : offset + 20].hex()
+            offset += 20
+        return type_, size, base, offset
+
+    def inflate(self, data_offset: int, size: int) -> bytes:
+        decompressor = zlib.decompressobj()
+        chunks = []
+        pos = data_offset
+        # small objects are usually covered by the first chunk, without dragging a
+        # whole INFLATE_CHUNK of trailing pack data into `unused_data`
+        chunk_size = min(size + 64, INFLATE_CHUNK)
+        while not decompressor.eof:
+            chunk = self.view[pos : pos + chunk_size]
+            if not chunk:
+                raise ValueError(f"truncated pack entry at {data_offset}")
+            chunks.append(decompressor.decompress(chunk))
+            pos += chunk_size
+            chunk_size = INFLATE_CHUNK
+        data = b"".join(chunks)
+        if len(data) != size:
+            raise ValueError(f"pack entry size mismatch at {data_offset}")
+        return data
+
+    def inflate_prefix(self, data_offset: int, size: int) -> bytes:
+        """The first `size` bytes of an entry, e.g. the source / target sizes of a delta"""
+        decompressor = zlib.decompressobj()
+        data = b""
+        pos = data_offset
+        while len(data) < size and not decompressor.eof:
+            compressed = decompressor.unconsumed_tail
+            if not compressed:
+                compressed = self.view[pos : pos + 64]
+                pos += 64
+            data += decompressor.decompress(compressed, size - len(data))
+        return data
+
+    def close(self):
+        self.view.release()
+        self._map.close()
+
+
+class Pack:
+    def __init__(self, idx_path: Path, base_cache: LRUCache):
+        self.index = PackIndex(idx_path)
+        self.pack = PackFile(idx_path.with_suffix(".pack"))
+        self.base_cache = base_cache
+
+    def read(self, offset: int, resolve_ref) -> (str, bytes):
+        """
+        Reconstruct the object stored at `offset`, following the delta chain down to its
+        base iteratively so that deep chains do not hit the recursion limit.
+        `resolve_ref(oid)` loads REF_DELTA bases that live outside of this pack.
+
+        Every object that serves as a base on the way is kept in the shared delta base
+        cache, keyed by pack offset: walking history or neighbouring trees then stops at
+        the first cached base instead of re-inflating the chain from its root.
+        """
+        deltas: list[(int, bytes)] = []
+        base_offset = None
+        while True:
+            cached = self.base_cache.get((self.pack.path, offset))
+            if cached is not None:
+                type_name, data = cached
+                break
+            type_, size, base, data_offset = self.pack.entry_header(offset)
+            if type_ == OBJ_OFS_DELTA:
+                deltas.append((offset, self.pack.inflate(data_offset, size)))
+                offset = base
+            elif type_ == OBJ_REF_DELTA:
+                deltas.append((offset, self.pack.inflate(data_offset, size)))
+                offset = self.index.find(base)
+                if offset is None:
+                    type_name, data = resolve_ref(base)
+                    break
+            else:
+                type_name, data = TYPE_NAMES[type_], self.pack.inflate(data_offset, size)
+                base_offset = offset
+                break
+
+        if deltas and base_offset is not None:
+            self.base_cache.put((self.pack.path, base_offset), (type_name, data), len(data))
+        for i, (delta_offset, delta) in enumerate(reversed(deltas), start=1):
+            data = apply_delta(data, delta)
+            if i < len(deltas):
+                self.base_cache.put((self.pack.path, delta_offset), (type_name, data), len(data))
+        return type_name, data
+
+    def open_stream(self, offset: int, resolve_ref) -> ObjectStream:
+        """
+        Whole objects are inflated from the mapped pack chunk by chunk; a delta needs
+        its base in memory anyway, so it is reconstructed first and then streamed.
+        """
+        type_, size, _, data_offset = self.pack.entry_header(offset)
+        if type_ in (OBJ_OFS_DELTA, OBJ_REF_DELTA):
+            return ObjectStream.from_bytes(*self.read(offset, resolve_ref))
+
+        def read_compressed() -> bytes:
+            nonlocal data_offset
+            chunk = self.pack.view[data_offset : data_offset + INFLATE_CHUNK]
+            data_offset += len(chunk)
+            return chunk
+
+        return ObjectStream(TYPE_NAMES[type_], size, inflate_chunks(read_compressed))
+
+    def read_header(self, offset: int, resolve_ref_header) -> (str, int):
+        """
+        The size comes from the entry itself or, for deltas, from the target size at the
+        head of the delta; the type is that of the base at the end of the chain, which
+        only needs the entry headers along the way.
+        """
+        type_, size, base, data_offset = self.pack.entry_header(offset)
+        if type_ in (OBJ_OFS_DELTA, OBJ_REF_DELTA):
+            # two varints of at most 10 bytes each
+            delta_head = self.pack.inflate_prefix(data_offset, 20)
+            _, pos = read_delta_size(delta_head, 0)
+            size, _ = read_delta_size(delta_head, pos)
+        while type_ in (OBJ_OFS_DELTA, OBJ_REF_DELTA):
+            if type_ == OBJ_REF_DELTA:
+                offset = self.index.find(base)
+                if offset is None:
+                    return resolve_ref_header(base)[0], size
+            else:
+                offset = base
+            type_, _, base, _ = self.pack.entry_header(offset)
+        return TYPE_NAMES[type_], size
+
+    def close(self):
+        self.index.close()
+        self.pack.close()
+
+
+class PackStore:
+    """All packs under .git/objects/pack, looked up before falling back to loose objects"""
+
+    def __init__(self, pack_dir: Path, *, delta_base_cache_limit: int = DELTA_BASE_CACHE_LIMIT):
+        self.pack_dir = pack_dir
+        self.base_cache = LRUCache(delta_base_cache_limit)
+        self._packs: dict[Path, Pack] = {}
+        self.reload()
+
+    def reload(self):
+        idx_paths = set(self.pack_dir.glob("pack-*.idx")) if self.pack_dir.exists() else set()
+        stales = set(self._packs) - idx_paths
+        for stale in stales:
+            self._packs.pop(stale).close()
+        if stales:
+            self.base_cache.clear()
+        for idx_path in sorted(idx_paths - set(self._packs)):
+            if idx_path.with_suffix(".pack").exists():
+                self._packs[idx_path] = Pack(idx_path, self.base_cache)
+
+    @property
+    def packs(self) -> list[Pack]:
+        return list(self._packs.values())
+
+    def locate(self, oid: str) -> tuple[Pack, int] | None:
+        for pack in self._packs.values():
+            offset = pack.index.find(oid)
+            if offset is not None:
+                return pack, offset
+        return None
+
+    def has(self, oid: str) -> bool:
+        return self.locate(oid) is not None
+
+    def read(self, oid: str, resolve_ref) -> tuple[str, bytes] | None:
+        located = self.locate(oid)
+        if located is None:
+            return None
+        pack, offset = located
+        return pack.read(offset, resolve_ref)
+
+    def read_header(self, oid: str, resolve_ref_header) -> tuple[str, int] | None:
+        located = self.locate(oid)
+        if located is None:
+            return None
+        pack, offset = located
+        return pack.read_header(offset, resolve_ref_header)
+
+    def open_stream(self, oid: str, resolve_ref) -> ObjectStream | None:
+        located = self.locate(oid)
+        if located is None:
+            return None
+        pack, offset = located
+        return pack.open_stream(offset, resolve_ref)
+
+    def prefix_match(self, prefix_oid: str) -> set[str]:
+        matched = set()
+        for pack in self._packs.values():
+            matched.update(pack.index.prefix_match(prefix_oid))
+        return matched
+
+
+@dataclass
+class PackedObject:
+    oid: str
+    type: str
+    size: int
+    name: str = ""
+    offset: int = 0
+    crc: int = 0
+    depth: int = 0
+
+
+class PackWriter:
+    """
+    Write a packfile plus its v2 .idx.
+
+    Objects are sorted by type, name and descending size so that similar objects sit
+    next to each other; each one is then delta compressed against the best candidate
+    among the previous `window` objects of the same type. Since a base always comes
+    earlier in that order, every delta can be stored as OFS_DELTA. Bases already at
+    `depth` are skipped, which bounds the work needed to reconstruct any object.
+    """
+
+    def __init__(
+        self, pack_dir: Path, load_content, *, window: int = 10, depth: int = MAX_DELTA_DEPTH
+    ):
+        self.pack_dir = pack_dir
+        self.load_content = load_content
+        self.window = window
+        self.depth = depth
+        self.deltas = 0
+
+    def write(self, objects: list[PackedObject]) -> Path:
+        objects = sorted(objects, key=lambda o: (TYPE_CODES[o.type], o.name, -o.size))
+        self.pack_dir.mkdir(parents=True, exist_ok=True)
+        tmp_pack = self.pack_dir / f"tmp_pack_{os.getpid()}"
+        tmp_idx = self.pack_dir / f"tmp_idx_{os.getpid()}"
+
+        checksum = hashlib.sha1()
+        with open(tmp_pack, "wb") as f:
+
+            def emit(data: bytes):
+                checksum.update(data)
+                f.write(data)
+
+            emit(PACK_SIGNATURE + (2).to_bytes(4, "big") + len(objects).to_bytes(4, "big"))
+            offset = 12
+            # each base keeps its DeltaIndex while in the window, built at most once
+            window: deque[(PackedObject, DeltaIndex)] = deque(maxlen=self.window)
+            for obj in objects:
+                content = self.load_content(obj.oid)
+                base, delta = self._find_delta(obj, content, window)
+                if base:
+                    self.deltas += 1
+                    obj.depth = base.depth + 1
+                    entry = self._entry_header(OBJ_OFS_DELTA, len(delta))
+                    entry += self._encode_offset(offset - base.offset)
+                    entry += zlib.compress(delta)
+                else:
+                    entry = self._entry_header(TYPE_CODES[obj.type], len(content))
+                    entry += zlib.compress(content)
+                obj.offset, obj.crc = offset, zlib.crc32(entry)
+                emit(entry)
+                offset += len(entry)
+                if self.window:
+                    window.appendleft((obj, DeltaIndex(content)))
+            pack_checksum = checksum.digest()
+            f.write(pack_checksum)
+
+        tmp_idx.write_bytes(self._index(objects, pack_checksum))
+        pack_path = self.pack_dir / f"pack-{pack_checksum.hex()}.pack"
+        # the .idx goes in last: readers only pick up packs whose index exists
+        os.replace(tmp_pack, pack_path)
+        os.replace(tmp_idx, pack_path.with_suffix(".idx"))
+        return pack_path
+
+    def _find_delta(
+        self, obj: PackedObject, content: bytes, window: deque
+    ) -> (PackedObject | None, bytes | None):
+        best_base, best_delta = None, None
+        for base, base_index in window:
+            if base.type != obj.type:
+                break
+            max_size = len(best_delta) - 1 if best_delta else obj.size // 2 - 20
+            if max_size <= 0:
+                break
+            # like git's try_delta: what the target has beyond the base must be inserted
+            # literally, a base that much smaller cannot give a delta under max_size
+            if obj.size - base.size >= max_size or base.depth >= self.depth:
+                continue
+            delta = create_delta(base_index, content, max_size=max_size)
+            if delta is not None:
+                best_base, best_delta = base, delta
+        return best_base, best_delta
+
+    @staticmethod
+    def _entry_header(type_: int, size: int) -> bytes:
+        byte = (type_ << 4) | (size & 0x0F)
+        size >>= 4
+        header = bytearray()
+        while size:
+            header.append(byte | 0x80)
+            byte = size & 0x7F
+            size >>= 7
+        header.append(byte)
+        return bytes(header)
+
+    @staticmethod
+    def _encode_offset(distance: int) -> bytes:
+        encoded = [distance & 0x7F]
+        distance >>= 7
+        while distance:
+            distance -= 1
+            encoded.append(0x80 | (distance & 0x7F))
+            distance >>= 7
+        return bytes(reversed(encoded))
+
+    @staticmethod
+    def _index(objects: list[PackedObject], pack_checksum: bytes) -> bytes:
+        objects = sorted(objects, key=lambda o: o.oid)
+        fanout = [0] * 256
+        for obj in objects:
+            fanout[int(obj.oid[:2], 16)] += 1
+        offsets, large_offsets = [], []
+        for obj in objects:
+            if obj.offset < 0x80000000:
+                offsets.append(obj.offset.to_bytes(4, "big"))
+            else:
+                offsets.append((0x80000000 | len(large_offsets)).to_bytes(4, "big"))
+                large_offsets.append(obj.offset.to_bytes(8, "big"))
+
+        data = b"".join(
+            [
+                IDX_SIGNATURE,
+                (2).to_bytes(4, "big"),
+                b"".join(n.to_bytes(4, "big") for n in itertools.accumulate(fanout)),
+                b"".join(bytes.fromhex(obj.oid) for obj in objects),
+                b"".join(obj.crc.to_bytes(4, "big") for obj in objects),
+                *offsets,
+                *large_offsets,
+                pack_checksum,
+            ]
+        )
+        return data + hashlib.sha1(data).digest()
+
+
+if __name__ == "__main__":
+    import random
+    import tempfile
+
+    print("Test objects written by PackWriter read back through PackStore")
+    random.seed(0)
+    contents = {}
+    content = bytes(random.randrange(256) for _ in range(8192))
+    for i in range(30):
+        # each version edits the previous one, which gives chains of deltas
+        start = random.randrange(len(content))
+        inserted = bytes(random.randrange(256) for _ in range(40))
+        content = content[:start] + inserted + content[start:]
+        contents[hashlib.sha1(b"blob %d\x00%s" % (len(content), content)).hexdigest()] = content
+    objects = [PackedObject(oid, "blob", len(data), "file") for oid, data in contents.items()]
+
+    def no_ref_delta(oid: str):
+        raise AssertionError(f"unexpected REF_DELTA base {oid}")
+
+    with tempfile.TemporaryDirectory() as pack_dir:
+        writer = PackWriter(Path(pack_dir), contents.__getitem__, depth=5)
+        writer.write(objects)
+        assert writer.deltas, "similar blobs should be stored as deltas"
+        assert max(obj.depth for obj in objects) <= 5
+
+        store = PackStore(Path(pack_dir))
+        for oid, data in contents.items():
+            assert store.read(oid, no_ref_delta) == ("blob", data)
+            assert store.read_header(oid, no_ref_delta) == ("blob", len(data))
+            with store.open_stream(oid, no_ref_delta) as stream:
+                assert stream.read() == data
+        assert store.prefix_match(next(iter(contents))[:6]) == {next(iter(contents))}
+        assert not store.has("0" * 40)
+        for pack in store.packs:
+            pack.close()
@@ -0,0 +1,100 @@
+from typing import Iterator
+
+
+class _Node:
+    __slots__ = ("children", "size", "is_file")
+
+    def __init__(self):
+        self.children: dict[str, "_Node"] = {}
+        # number of files at or below this node
+        self.size = 0
+        self.is_file = False
+
+
+class PathTrie:
+    """
+    The tracked paths split on `/`, one node per path component. Looking a file or a
+    directory up costs one dict lookup per component, and the files below a directory
+    come out in index order, i.e. sorted as byte strings where a directory sorts as
+    its name followed by `/`.
+    """
+
+    def __init__(self, paths=()):
+        self._root = _Node()
+        for path in paths:
+            self.add(path)
+
+    def __len__(self):
+        return self._root.size
+
+    def _find(self, path: str) -> _Node | None:
+        node = self._root
+        for part in filter(None, path.split("/")):
+            node = node.children.get(part)
+            if node is None:
+                return None
+        return node
+
+    def add(self, path: str):
+        node = self._find(path)
+        if node is not None and node.is_file:
+            return
+        node = self._root
+        node.size += 1
+        for part in path.split("/"):
+            node = node.children.setdefault(part, _Node())
+            node.size += 1
+        node.is_file = True
+
+    def remove(self, path: str):
+        node = self._find(path)
+        if node is None or not node.is_file:
+            return
+        node = self._root
+        node.size -= 1
+        for part in path.split("/"):
+            child = node.children[part]
+            child.size -= 1
+            if not child.size:
+                del node.children[part]
+                return
+            node = child
+        node.is_file = False
+
+    def __contains__(self, path: str) -> bool:
+        """Whether `path` is a tracked file or a directory with tracked files below it"""
+        node = self._find(path)
+        return node is not None and node.size > 0
+
+    def has_file(self, path: str) -> bool:
+        node = self._find(path)
+        return node is not None and node.is_file
+
+    def has_dir(self, path: str) -> bool:
+        node = self._find(path)
+        return node is not None and bool(node.children)
+
+    def children(self, path: str = "") -> dict[str, (bool, bool)]:
+        """Name -> (is a tracked file, is a directory with tracked files) below `path`"""
+        node = self._find(path)
+        if node is None:
+            return {}
+        return {
+            name: (child.is_file, bool(child.children))
+            for name, child in node.children.items()
+        }
+
+    def iter_prefix(self, path: str = "") -> Iterator[str]:
+        """Tracked files equal to or below `path`, in index order"""
+        node = self._find(path)
+        if node is None:
+            return
+        yield from self._iter(node, path.strip("/"))
+
+    def _iter(self, node: _Node, path: str) -> Iterator[str]:
+        if node.is_file:
+            yield path
+        for name in sorted(
+            node.children, key=lambda n: n + "/" if node.children[n].children else n
+        ):
+            yield from self._iter(node.children[name], f"{path}/{name}" if path else name)
@@ -0,0 +1,51 @@
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
+from itertools import groupby
+from pathlib import Path
+from typing import Callable, Hashable
+
+from pit.database import Database
+
+# below this many items the pool costs more to start than it saves
+PARALLEL_THRESHOLD = 64
+
+
+@lru_cache()
+def worker_database(root_dir: str, quarantine: str = None) -> Database:
+    """
+    The Database of a task, built once per process and reused by every later task in
+    it. `quarantine` joins the object transaction that started the tasks.
+    """
+    return Database(Path(root_dir), quarantine=Path(quarantine) if quarantine else None)
+
+
+def run_batches(
+    function: Callable[..., list],
+    args: tuple,
+    items: list,
+    *,
+    workers: int,
+    key: Callable[[object], Hashable] = None,
+) -> list:
+    """
+    Call `function(*args, batch)` on batches of `items` and return all their results in
+    order. `function` must be a module-level function so that it can be sent to the
+    workers. Batches are the runs of items sharing the same `key`, e.g. the files of one
+    directory, or else even chunks of the items. With a single worker or fewer than
+    PARALLEL_THRESHOLD items everything runs here as one batch, otherwise on a pool of
+    up to `workers` processes.
+    """
+    if workers <= 1 or len(items) < PARALLEL_THRESHOLD:
+        return function(*args, items)
+    if key is None:
+        size = max(1, len(items) // (workers * 4))
+        batches = [items[i : i + size] for i in range(0, len(items), size)]
+    else:
+        batches = [list(group) for _, group in groupby(items, key=key)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        chunksize = max(1, len(batches) // (workers * 4))
+        return [
+            result
+            for results in executor.map(partial(function, *args), batches, chunksize=chunksize)
+            for result in results
+        ]
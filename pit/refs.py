@@ -10,6 +10,7 @@ class Refs:
         self.git_dir = self.root_dir / ".git"
         self.refs_dir = self.git_dir / "refs/heads"
         self.head = self.git_dir / "HEAD"
+        self.packed_refs_path = self.git_dir / "packed-refs"
 
     def init(self):
         self.refs_dir.mkdir(parents=True, exist_ok=True)
@@ -40,10 +41,37 @@ class Refs:
             return None
         return self._find_ref(ref_path).read_text().strip() or None
 
+    @property
+    def packed_refs(self) -> dict[str, str]:
+        """refs/... -> oid, as written by `git pack-refs` / `git gc`"""
+        if not self.packed_refs_path.exists():
+            return {}
+        packed = {}
+        for line in self.packed_refs_path.read_text().splitlines():
+            if not line or line.startswith(("#", "^")):
+                continue
+            oid, name = line.split(" ", 1)
+            packed[name] = oid
+        return packed
+
+    def list_refs(self) -> dict[str, str]:
+        """Every refs/... -> oid, loose refs taking precedence over packed-refs"""
+        refs = self.packed_refs
+        for ref_path in (self.git_dir / "refs").rglob("*"):
+            if not ref_path.is_file():
+                continue
+            oid = ref_path.read_text().strip()
+            # symbolic refs such as refs/remotes/origin/HEAD point at a listed ref
+            if oid and not oid.startswith("ref: "):
+                refs[ref_path.relative_to(self.git_dir).as_posix()] = oid
+        return refs
+
     def _find_ref(self, ref_path: Path) -> Path:
         if not ref_path.exists():
             ref_path.parent.mkdir(parents=True, exist_ok=True)
-            ref_path.write_text("")
+            # a loose ref takes precedence over packed-refs, so unpacking it is safe
+            packed_oid = self.packed_refs.get(ref_path.relative_to(self.git_dir).as_posix())
+            ref_path.write_text(packed_oid or "")
             return ref_path
 
         ref = ref_path.read_text().strip()
@@ -60,11 +88,27 @@ class Refs:
         branch_path.write_text(oid)
 
     def list_branches(self) -> list[str]:
-        return [branch.name for branch in self.refs_dir.iterdir()]
+        branches = {branch.name for branch in self.refs_dir.iterdir()}
+        branches.update(
+            name[len("refs/heads/") :]
+            for name in self.packed_refs
+            if name.startswith("refs/heads/")
+        )
+        return sorted(branches)
 
     def delete_branch(self, name: str):
         branch_path = self.refs_dir / str(name)
         branch_path.unlink(missing_ok=True)
+        if f"refs/heads/{name}" in self.packed_refs:
+            lines = self.packed_refs_path.read_text().splitlines(keepends=True)
+            kept, skip_peeled = [], False
+            for line in lines:
+                if skip_peeled and line.startswith("^"):
+                    continue
+                skip_peeled = line.rstrip("\n").endswith(f" refs/heads/{name}")
+                if not skip_peeled:
+                    kept.append(line)
+            self.packed_refs_path.write_text("".join(kept))
 
     def read_branch(self, name: str) -> str:
         branch_name = BranchName(name)
@@ -74,7 +118,7 @@ class Refs:
     def current_branch(self) -> str | None:
         if self.is_detached():
             return None
-        return self.head.read_text().split("/")[-1]
+        return self.head.read_text().strip().split("/")[-1]
 
     def _write_branch(self, path: Path, oid: str):
         path.write_text(oid)
@@ -1,18 +1,37 @@
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
 from functools import cached_property
 from pathlib import Path
+import os
+import time
 
-from pit.constants import IGNORE
+from pit.config import Config
+from pit import fsmonitor
 from pit.database import Database
+from pit.flat_tree import FlatTree, FlatTreeCache
+from pit.fsmonitor import FSMonitorState
 from pit.git_object import Commit, Tree, TreeEntry
+from pit.ignore import IGNORE_FILE, GitIgnore
 from pit.index import Index
 from pit.refs import Refs
+from pit.sparse_checkout import SparseCheckout
+from pit.untracked_cache import UntrackedCache, UntrackedDir, chain_key, exclude_key
 from pit.values import GitFileMode
 
+# fewer tracked paths than this per thread are not worth a thread, as in git
+PRELOAD_CHUNK = 500
+# file system timestamps are coarse, trust a directory mtime only when it is older
+UNTRACKED_RACY_WINDOW_NS = 1_000_000_000
+
+
+def join_path(dir_path: str, name: str) -> str:
+    return f"{dir_path}/{name}" if dir_path else name
+
 
 @dataclass()
 class FileStatusGroup:
     root_dir: Path
+    # HEAD entries of the paths that are modified or deleted in the index
     head_tree: dict[str, TreeEntry] = field(default_factory=dict)
     workspace_modified: set[str] = field(default_factory=set)
     workspace_added: set[str] = field(default_factory=set)
@@ -26,105 +45,299 @@ class FileStatusGroup:
 class Repository:
     def __init__(self, root_dir: str):
         self.root_dir = Path(root_dir)
+        # set when status refreshed index extensions that are worth writing back
+        self.index_refreshed = False
+        self.fsmonitor_token: str | None = None
 
     @cached_property
     def index(self):
-        return Index(self.root_dir)
+        return Index(self.root_dir, version=self.config.get_int("index.version"))
 
     @cached_property
     def database(self):
-        return Database(self.root_dir)
+        return Database(self.root_dir, self.config)
 
     @cached_property
     def refs(self):
         return Refs(self.root_dir)
 
     @cached_property
-    def ignores(self) -> list[str]:
-        ignore_file = Path(self.root_dir) / ".gitignore"
-        if not ignore_file.exists():
-            return [".git"]
-        git_ignores = {str(p).strip() for p in ignore_file.read_text().split("\n") if p}
-        return list(git_ignores | IGNORE)
+    def config(self):
+        return Config(self.root_dir / ".git/config")
 
     @cached_property
-    def status(self) -> FileStatusGroup:
-        status = FileStatusGroup(root_dir=self.root_dir)
+    def flat_trees(self) -> FlatTreeCache:
+        return FlatTreeCache(
+            self.root_dir / ".git", lambda tree_oid: self._flatten_tree(tree_oid, "")
+        )
 
-        # check workspace / index differences
-        existed_files = set()
-        for path in self.root_dir.rglob("*"):
-            path = path.relative_to(self.root_dir)
-            existed_files.add(str(path))
-            if any(ignore in path.parts for ignore in self.ignores):
-                continue
-            if path.is_dir():
-                continue
-            if self.index.has_tracked(path):
-                if self.index.has_modified(path):
-                    status.workspace_modified.add(str(path))
-                continue
+    @cached_property
+    def sparse_checkout(self) -> SparseCheckout | None:
+        return SparseCheckout.load(self.root_dir / ".git")
 
-            if len(path.parts) == 1:
-                status.workspace_added.add(str(path))
-            else:
-                for parent in reversed(path.parents[:-1]):
-                    if str(parent) in status.workspace_added:
-                        break
-                    if not self.index.has_tracked(parent):
-                        status.workspace_added.add(str(parent))
-                        break
+    @cached_property
+    def ignore(self) -> GitIgnore:
+        return GitIgnore(self.root_dir)
+
+    @cached_property
+    def untracked_cache(self) -> UntrackedCache | None:
+        """
+        The cache of directory listings kept in the index, only used when
+        core.untrackedCache is set. It is dropped whenever .git/info/exclude changes.
+        """
+        if not self.config.get_bool("core.untrackedCache", False):
+            return None
+        if self.index.untracked_cache is None:
+            self.index.untracked_cache = UntrackedCache()
+        info_exclude_key = exclude_key(self.root_dir / ".git/info/exclude")
+        if self.index.untracked_cache.exclude_key != info_exclude_key:
+            self.index.untracked_cache.reset(info_exclude_key)
+        return self.index.untracked_cache
+
+    def _query_fsmonitor(self):
+        """
+        Ask the fsmonitor daemon, when core.fsmonitor is set, which paths changed since
+        the token kept in the index. The answer stays None when the daemon is not
+        running or the token is stale, and then every path has to be checked.
+        """
+        if not self.config.get_bool("core.fsmonitor", False):
+            return
+        state = self.index.fsmonitor
+        answer = fsmonitor.query(self.root_dir / ".git", state.token if state else "")
+        if answer is not None:
+            self.fsmonitor_token, self.index.fsmonitor_changes = answer
+
+    def _update_fsmonitor(self, status: FileStatusGroup):
+        """Remember the new token and the tracked paths that are not clean at it"""
+        if self.fsmonitor_token is None:
+            return
+        dirty = status.workspace_modified | status.workspace_deleted
+        state = self.index.fsmonitor
+        changes = self.index.fsmonitor_changes
+        if state is None or changes is None or changes or state.dirty != dirty:
+            # an unchanged workspace keeps its old token, so status need not rewrite the index
+            self.index.fsmonitor = FSMonitorState(token=self.fsmonitor_token, dirty=dirty)
+            self.index_refreshed = True
+
+    def _find_untracked(self, status: FileStatusGroup):
+        """
+        Walk the workspace for untracked files, reporting a directory instead of its
+        files when nothing below it is tracked. With the untracked cache every
+        directory whose mtime is unchanged costs one stat instead of a listing, and
+        one the fsmonitor daemon reported nothing in costs nothing at all. Directories
+        outside the sparse checkout cone are never entered.
+        """
+        scan_started_ns = time.time_ns()
+        sparse = self.sparse_checkout
+        changes = self.index.fsmonitor_changes
+        changed_dirs = None
+        if changes is not None:
+            changed_dirs = changes | {p.rpartition("/")[0] for p in changes}
+
+        def list_dir(dir_path: str, parent_excludes: int) -> (list[str], list[str], int):
+            """Not ignored untracked files and sub directories, and the .gitignore key"""
+            full_path = self.root_dir / dir_path
+            cache = self.untracked_cache
+            excludes = 0
+            if cache is not None:
+                cached = cache.dirs.get(dir_path)
+                trusted = changed_dirs is not None and dir_path not in changed_dirs
+                if trusted and cached is not None:
+                    own_key = cached.exclude_key
                 else:
-                    status.workspace_added.add(str(path))
-        for index_file in self.index.entries:
-            if index_file not in existed_files:
-                status.workspace_deleted.add(index_file)
+                    own_key = exclude_key(full_path / IGNORE_FILE)
+                excludes = chain_key(parent_excludes, own_key)
+                if cached is not None and cached.excludes != excludes:
+                    cached = None
+                if cached is not None and trusted:
+                    return cached.files, cached.dirs, excludes
+                mtime_ns = full_path.stat().st_mtime_ns
+                if cached is not None and cached.mtime_ns == mtime_ns:
+                    return cached.files, cached.dirs, excludes
 
-        # check index / commit differences
-        if self.refs.read_head():
-            # noinspection PyTypeChecker
-            commit: Commit = self.database.load(self.refs.read_head())
-            # noinspection PyTypeChecker
-            tree: Tree = self.database.load(commit.tree_oid)
-
-            def flatten_tree(
-                tree_entries: list[TreeEntry], parent: str = None
-            ) -> list[TreeEntry]:
-                flatten = []
-                for entry in tree_entries:
-                    entry_path = f"{parent}/{entry.path}" if parent else entry.path
-                    if GitFileMode(entry.mode).is_file():
-                        entry.path = entry_path
-                        flatten.append(entry)
+            files, dirs = [], []
+            with os.scandir(full_path) as it:
+                for entry in it:
+                    path = join_path(dir_path, entry.name)
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                    if self.ignore.is_ignored(path, is_dir):
                         continue
-                    # noinspection PyTypeChecker
-                    sub_tree: Tree = self.database.load(entry.oid)
-                    flatten.extend(
-                        flatten_tree(
-                            sub_tree.entries,
-                            parent=entry_path,
-                        )
-                    )
-                return flatten
+                    if is_dir:
+                        dirs.append(entry.name)
+                    elif path not in self.index.entries:
+                        files.append(entry.name)
+            if cache is not None:
+                # a directory changed within the racy window may change again unnoticed
+                if mtime_ns < scan_started_ns - UNTRACKED_RACY_WINDOW_NS:
+                    cache.put(dir_path, UntrackedDir(mtime_ns, own_key, excludes, files, dirs))
+                else:
+                    cache.drop(dir_path)
+            return files, dirs, excludes
 
-            flatten_entries = flatten_tree(tree.entries)
-            commit_entries: dict[str, TreeEntry] = {e.path: e for e in flatten_entries}
-        else:
-            commit_entries = {}
-        status.head_tree = commit_entries
+        def contains_files(dir_path: str, parent_excludes: int) -> bool:
+            files, dirs, excludes = list_dir(dir_path, parent_excludes)
+            return bool(files) or any(
+                contains_files(join_path(dir_path, d), excludes) for d in dirs
+            )
 
-        for entry_path, index_entry in self.index.entries.items():
-            commit_entry = commit_entries.get(entry_path)
-            if not commit_entry:
-                status.index_added.add(entry_path)
+        def walk(dir_path: str, parent_excludes: int):
+            files, dirs, excludes = list_dir(dir_path, parent_excludes)
+            for name in files:
+                path = join_path(dir_path, name)
+                if path not in self.index.entries:
+                    status.workspace_added.add(path)
+            for name in dirs:
+                path = join_path(dir_path, name)
+                if sparse is not None and not sparse.includes_dir(path):
+                    continue
+                if self.index.tracked_paths.has_dir(path):
+                    walk(path, excludes)
+                elif contains_files(path, excludes):
+                    status.workspace_added.add(path)
+
+        walk("", 0)
+
+    def _preload(self, paths: list[str]) -> list[(set[str], set[str])]:
+        """
+        lstat, and hash where the stat data does not settle it, every tracked path like
+        git's core.preloadIndex: the paths are split into chunks of at least
+        PRELOAD_CHUNK entries checked on up to index.threads threads, which keeps many
+        stats in flight on a cold or network file system. Merging the (modified, deleted)
+        sets of every chunk gives the same result as checking them one by one.
+        """
+        threads = self.config.get_int("index.threads", min(os.cpu_count() or 1, 20))
+        if not self.config.get_bool("core.preloadIndex", True):
+            threads = 1
+        threads = max(1, min(threads, len(paths) // PRELOAD_CHUNK))
+        if threads == 1:
+            return [self._check_tracked(paths)]
+        chunk_size = -(-len(paths) // threads)
+        chunks = [paths[i : i + chunk_size] for i in range(0, len(paths), chunk_size)]
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            return list(executor.map(self._check_tracked, chunks))
+
+    def _check_tracked(self, paths: list[str]) -> (set[str], set[str]):
+        modified, deleted = set(), set()
+        for entry_path in paths:
+            path = self.root_dir / entry_path
+            if not (path.is_file() or path.is_symlink()):
+                deleted.add(entry_path)
+            elif self.index.has_modified(path):
+                modified.add(entry_path)
+        return modified, deleted
+
+    def _compare_head_tree(self, tree_oid: str, dir_path: str, status: FileStatusGroup):
+        """
+        Walk a HEAD tree and the index side by side, the way git's unpack_trees does. A
+        directory whose cached tree in the index still has the same oid is identical on
+        both sides and is skipped without loading it, so with a valid cache tree the
+        cost follows the directories with staged changes, not the size of the tree.
+        """
+        cached = self.index.cache_tree.find(dir_path)
+        if cached is not None and cached.valid and cached.oid == tree_oid:
+            return
+
+        # noinspection PyTypeChecker
+        tree: Tree = self.database.load(tree_oid)
+        index_children = self.index.tracked_paths.children(dir_path)
+        for entry in tree.entries:
+            path = join_path(dir_path, entry.path)
+            in_index_file, in_index_dir = index_children.pop(entry.path, (False, False))
+            if GitFileMode(entry.mode).is_file():
+                if in_index_dir:
+                    status.index_added.update(
+                        p for p in self.index.tracked_paths.iter_prefix(path) if p != path
+                    )
+                head_entry = TreeEntry(oid=entry.oid, path=path, mode=entry.mode)
+                if not in_index_file:
+                    status.index_deleted.add(path)
+                    status.head_tree[path] = head_entry
+                    continue
+                index_entry = self.index.entries[path]
+                if (
+                    index_entry.file_hash.hex() != entry.oid
+                    or index_entry.mode != entry.mode
+                ):
+                    status.index_modified.add(path)
+                    status.head_tree[path] = head_entry
                 continue
-            if (
-                index_entry.file_hash.hex() != commit_entry.oid
-                or index_entry.mode != commit_entry.mode
+
+            if in_index_file:
+                status.index_added.add(path)
+            if in_index_dir:
+                self._compare_head_tree(entry.oid, path, status)
+            else:
+                for head_entry in self._flatten_tree(entry.oid, path):
+                    status.index_deleted.add(head_entry.path)
+                    status.head_tree[head_entry.path] = head_entry
+
+        for name, (in_index_file, in_index_dir) in index_children.items():
+            status.index_added.update(
+                self.index.tracked_paths.iter_prefix(join_path(dir_path, name))
+            )
+
+    def _compare_flat_tree(self, flat_tree: FlatTree, status: FileStatusGroup):
+        """
+        Compare the index with the flattened HEAD tree entry by entry. Used when the
+        index carries no cached trees to skip directories with, e.g. after another tool
+        rewrote it, so that no tree object has to be loaded.
+        """
+        head_paths = set()
+        for head_entry in flat_tree.entries():
+            head_paths.add(head_entry.path)
+            index_entry = self.index.entries.get(head_entry.path)
+            if index_entry is None:
+                status.index_deleted.add(head_entry.path)
+                status.head_tree[head_entry.path] = head_entry
+            elif (
+                index_entry.file_hash.hex() != head_entry.oid
+                or index_entry.mode != head_entry.mode
             ):
-                status.index_modified.add(entry_path)
-                continue
-        for entry_path in commit_entries.keys():
-            if entry_path not in self.index.entries:
-                status.index_deleted.add(entry_path)
+                status.index_modified.add(head_entry.path)
+                status.head_tree[head_entry.path] = head_entry
+        status.index_added.update(p for p in self.index.entries if p not in head_paths)
+
+    def _flatten_tree(self, tree_oid: str, dir_path: str) -> list[TreeEntry]:
+        flatten = []
+        # noinspection PyTypeChecker
+        tree: Tree = self.database.load(tree_oid)
+        for entry in tree.entries:
+            entry_path = join_path(dir_path, entry.path)
+            if GitFileMode(entry.mode).is_file():
+                # loaded trees are shared through the object cache, never mutate them
+                flatten.append(TreeEntry(oid=entry.oid, path=entry_path, mode=entry.mode))
+            else:
+                flatten.extend(self._flatten_tree(entry.oid, entry_path))
+        return flatten
+
+    @cached_property
+    def status(self) -> FileStatusGroup:
+        status = FileStatusGroup(root_dir=self.root_dir)
+
+        # check workspace / index differences
+        self._query_fsmonitor()
+        paths = [p for p in self.index.entries if not self.index.is_fsmonitor_clean(p)]
+        if self.sparse_checkout is not None:
+            # skip-worktree files are not in the workspace, there is nothing to stat
+            paths = [p for p in paths if self.sparse_checkout.includes(p)]
+        for modified, deleted in self._preload(paths):
+            status.workspace_modified |= modified
+            status.workspace_deleted |= deleted
+        self._find_untracked(status)
+        self._update_fsmonitor(status)
+        if self.untracked_cache is not None and self.untracked_cache.changed:
+            self.index_refreshed = True
+
+        # check index / commit differences
+        head = self.refs.read_head()
+        if head:
+            # noinspection PyTypeChecker
+            commit: Commit = self.database.load(head)
+            cache_tree = self.index.cache_tree
+            if cache_tree.valid or cache_tree.children:
+                self._compare_head_tree(commit.tree_oid, "", status)
+            else:
+                self._compare_flat_tree(self.flat_trees.get(commit.tree_oid), status)
+        else:
+            status.index_added.update(self.index.entries)
         return status
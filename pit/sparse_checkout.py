@@ -0,0 +1,89 @@
+import posixpath
+from dataclasses import dataclass, field
+from functools import cached_property
+from pathlib import Path
+
+SPARSE_CHECKOUT_FILE = "info/sparse-checkout"
+
+
+def parent_dirs(path: str) -> list[str]:
+    """Every directory above `path`, the root ("") first"""
+    parts = path.split("/")[:-1]
+    return [""] + ["/".join(parts[: i + 1]) for i in range(len(parts))]
+
+
+@dataclass
+class SparseCheckout:
+    """
+    Cone mode sparse checkout as written to .git/info/sparse-checkout by git: the
+    workspace holds every file below one of `dirs`, plus the files directly inside
+    the root and inside every directory leading to one of `dirs`. For `a/b` git writes
+
+        /*
+        !/*/
+        /a/
+        !/a/*/
+        /a/b/
+
+    where a directory followed by `!/<dir>/*/` is only a parent of the cone.
+    """
+
+    dirs: set[str] = field(default_factory=set)
+
+    def __post_init__(self):
+        # a directory below another one of the cone adds nothing to it
+        self.dirs = {
+            d for d in self.dirs if not any(p in self.dirs for p in parent_dirs(d)[1:])
+        }
+
+    @cached_property
+    def parents(self) -> set[str]:
+        return {parent for dir_path in self.dirs for parent in parent_dirs(dir_path)}
+
+    def includes(self, path: str) -> bool:
+        """Whether the file at `path` belongs in the workspace"""
+        parents = parent_dirs(path)
+        return parents[-1] in self.parents or any(p in self.dirs for p in parents[1:])
+
+    def includes_dir(self, dir_path: str) -> bool:
+        """Whether anything below `dir_path` belongs in the workspace"""
+        return dir_path in self.parents or any(
+            p in self.dirs for p in parent_dirs(dir_path)[1:] + [dir_path]
+        )
+
+    def __str__(self):
+        lines = ["/*", "!/*/"]
+        for dir_path in sorted(self.parents - {""}):
+            lines += [f"/{dir_path}/", f"!/{dir_path}/*/"]
+        lines += [f"/{dir_path}/" for dir_path in sorted(self.dirs)]
+        return "".join(f"{line}\n" for line in lines)
+
+    @classmethod
+    def from_text(cls, text: str) -> "SparseCheckout":
+        listed, parents = [], set()
+        for line in text.splitlines():
+            line = line.strip()
+            if not line or line.startswith("#") or line in ("/*", "!/*/"):
+                continue
+            if line.startswith("!") and line.endswith("/*/"):
+                parents.add(line[2:-3])
+            elif line.startswith("/") and line.endswith("/"):
+                listed.append(line[1:-1])
+        return SparseCheckout(dirs={d for d in listed if d not in parents})
+
+    @classmethod
+    def load(cls, git_dir: Path) -> "SparseCheckout | None":
+        """None when the repository has no sparse checkout"""
+        try:
+            return cls.from_text((git_dir / SPARSE_CHECKOUT_FILE).read_text())
+        except FileNotFoundError:
+            return None
+
+    def store(self, git_dir: Path):
+        path = git_dir / SPARSE_CHECKOUT_FILE
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(str(self))
+
+    @staticmethod
+    def normalize(dir_path: str) -> str:
+        return posixpath.normpath(dir_path.replace("\\", "/")).strip("/")
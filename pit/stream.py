@@ -0,0 +1,74 @@
+import io
+import zlib
+from typing import Callable, Iterator
+
+from pit.git_object import CHUNK_SIZE
+
+
+def inflate_chunks(read_compressed: Callable[[], bytes]) -> Iterator[bytes]:
+    """Inflate a zlib stream into chunks of at most CHUNK_SIZE bytes"""
+    decompressor = zlib.decompressobj()
+    while not decompressor.eof:
+        compressed = decompressor.unconsumed_tail or read_compressed()
+        if not compressed:
+            raise ValueError("truncated zlib stream")
+        chunk = decompressor.decompress(compressed, CHUNK_SIZE)
+        if chunk:
+            yield chunk
+
+
+class ObjectStream(io.RawIOBase):
+    """
+    Read-only file object over the content of a git object, without its header.
+    Content is produced chunk by chunk, so copying it with shutil.copyfileobj never
+    holds more than one chunk in memory.
+    """
+
+    def __init__(self, type_: str, size: int, chunks: Iterator[bytes], on_close: Callable = None):
+        super().__init__()
+        self.type = type_
+        self.size = size
+        self._chunks = chunks
+        self._pending = memoryview(b"")
+        self._on_close = on_close
+
+    @classmethod
+    def from_bytes(cls, type_: str, content: bytes) -> "ObjectStream":
+        view = memoryview(content)
+        chunks = (view[i : i + CHUNK_SIZE] for i in range(0, len(content), CHUNK_SIZE))
+        return ObjectStream(type_, len(content), chunks)
+
+    @classmethod
+    def from_loose(cls, chunks: Iterator[bytes], on_close: Callable) -> "ObjectStream":
+        """`chunks` still starts with the `<type> <size>\\x00` header of the loose object"""
+        head = b""
+        while b"\x00" not in head:
+            head += next(chunks)
+        head, rest = head.split(b"\x00", 1)
+        type_, size = head.split(b" ")
+
+        def content() -> Iterator[bytes]:
+            if rest:
+                yield rest
+            yield from chunks
+
+        return ObjectStream(type_.decode(), int(size), content(), on_close)
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self._pending:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return 0
+            self._pending = memoryview(chunk)
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+    def close(self):
+        if not self.closed and self._on_close:
+            self._on_close()
+        super().close()
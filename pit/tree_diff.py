@@ -102,7 +102,7 @@ class TreeDiff:
                     )
                 )
             else:
-                changes[parent / changed] = Deleted(after_child)
+                changes[parent / changed] = Deleted(before_child)
                 changes.update(
                     cls._diff(
                         None,
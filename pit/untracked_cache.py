@@ -0,0 +1,115 @@
+import hashlib
+import struct
+from dataclasses import dataclass, field
+from pathlib import Path
+
+
+def exclude_key(path: Path) -> int:
+    """Digest of the stat data of an exclude file, 0 when there is none"""
+    try:
+        file_stat = path.stat()
+    except (FileNotFoundError, NotADirectoryError):
+        return 0
+    return chain_key(file_stat.st_mtime_ns, file_stat.st_size)
+
+
+def chain_key(parent: int, own: int) -> int:
+    return int.from_bytes(hashlib.sha1(b"%d %d" % (parent, own)).digest()[:8], "big")
+
+
+@dataclass
+class UntrackedDir:
+    mtime_ns: int
+    # key of the directory's own .gitignore, and of every .gitignore from the root down
+    exclude_key: int = 0
+    excludes: int = 0
+    files: list[str] = field(default_factory=list)
+    dirs: list[str] = field(default_factory=list)
+
+
+@dataclass
+class UntrackedCache:
+    """
+    Per directory of the workspace: its mtime when it was last listed, the untracked
+    (and not ignored) files directly inside it and its not ignored sub directories.
+    As long as the mtime of a directory is unchanged its entries are unchanged too, so
+    status only lists the directories whose mtime moved instead of walking the tree.
+
+    Adding or removing an index entry changes which files count as untracked, so it
+    drops the entry of the parent directory. Each entry also records the stat data of
+    the .gitignore files from the root down to the directory, and is not used once any
+    of them changed. A change to .git/info/exclude drops the whole cache.
+
+    Stored as an optional index extension. git's own UNTR extension encodes entries
+    with EWAH bitmaps and exclude file oids, so pit uses its own signature, which git
+    skips like any unknown optional extension.
+        - 8 bytes key of .git/info/exclude
+        - 4 bytes number of directories, then for each directory
+            - NUL terminated path, 8 bytes mtime_ns, 8 bytes key of its .gitignore,
+              8 bytes key of all the .gitignore above, 4 bytes file count, 4 bytes dir count
+            - the NUL terminated names of the files and then of the dirs
+    """
+
+    exclude_key: int = 0
+    dirs: dict[str, UntrackedDir] = field(default_factory=dict)
+    changed: bool = False
+
+    SIGNATURE = b"PUNT"
+    HEADER = struct.Struct(">QI")
+    DIR = struct.Struct(">QQQII")
+
+    def put(self, dir_path: str, cached: UntrackedDir):
+        self.dirs[dir_path] = cached
+        self.changed = True
+
+    def drop(self, dir_path: str):
+        if self.dirs.pop(dir_path, None) is not None:
+            self.changed = True
+
+    def invalidate(self, path: str):
+        self.drop(path.rpartition("/")[0])
+
+    def reset(self, exclude_key: int):
+        if self.dirs or self.exclude_key != exclude_key:
+            self.changed = True
+        self.exclude_key = exclude_key
+        self.dirs = {}
+
+    def __bytes__(self):
+        data = [self.HEADER.pack(self.exclude_key, len(self.dirs))]
+        for dir_path, cached in sorted(self.dirs.items()):
+            data.append(b"%s\x00" % dir_path.encode())
+            data.append(
+                self.DIR.pack(
+                    cached.mtime_ns,
+                    cached.exclude_key,
+                    cached.excludes,
+                    len(cached.files),
+                    len(cached.dirs),
+                )
+            )
+            data.extend(b"%s\x00" % name.encode() for name in [*cached.files, *cached.dirs])
+        return b"".join(data)
+
+    @classmethod
+    def from_raw(cls, raw) -> "UntrackedCache":
+        raw = bytes(raw)
+        info_exclude_key, count = cls.HEADER.unpack_from(raw, 0)
+        offset = cls.HEADER.size
+
+        def read_name() -> str:
+            nonlocal offset
+            end = raw.index(b"\x00", offset)
+            name = raw[offset:end].decode()
+            offset = end + 1
+            return name
+
+        dirs = {}
+        for _ in range(count):
+            dir_path = read_name()
+            mtime_ns, key, excludes, file_count, dir_count = cls.DIR.unpack_from(raw, offset)
+            offset += cls.DIR.size
+            files = [read_name() for _ in range(file_count)]
+            sub_dirs = [read_name() for _ in range(dir_count)]
+            dirs[dir_path] = UntrackedDir(mtime_ns, key, excludes, files, sub_dirs)
+        return UntrackedCache(exclude_key=info_exclude_key, dirs=dirs)